@@ -7,22 +7,37 @@ import numpy as np
 import pygame as pg
 import pygame.surfarray
 import asyncio
+import functools
+import hashlib
+import json
 import math
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+import kernels
 
 
-async def main():
+async def main(sim_rate=int(os.environ.get('DEAD_END_SIM_RATE', 60)), render_fps=int(os.environ.get('DEAD_END_FPS', 0))):
+    # simulation steps per second, frames drawn per second at most with 0 for as fast as they come
     FOV = 60
+    step = 2/sim_rate # in the same units as er, 500 ms
     pg.init()
     pg.display.set_caption("Chemical X - A Python game by Group 1, thanks for playing!")
     font = pg.font.SysFont("Comic Sans M", 60)
+    debug_font = pg.font.SysFont("Comic Sans M", 20)
 
-    sounds = load_sounds()
+    bundle = AssetBundle.open() # None when not built or stale, the raw assets are loaded then
+    sounds = load_sounds(bundle)
     m_vol, sfx_vol, music = 0.4, 0.5, 0
     set_volume(m_vol, sfx_vol, sounds)
     sounds['music'+str(music)].play(-1)
 
     stepdelay = pg.time.get_ticks()/200
     stepdelay2 = stepdelay
+    sim_ticks = stepdelay # in pg ticks like those, but only running with the simulation
     click, clickdelay = 0, stepdelay
 
     screen = pg.display.set_mode((800,600))
@@ -33,6 +48,7 @@ async def main():
     pg.event.set_grab(1)
     timer = 0
     hres, halfvres, mod, frame, half_frame = adjust_resolution()
+    user_hres = hres # the resolution picked in the options, the governor may render below it
     fullscreen = 0
     level, player_health, swordsp, story = 0, 0, 0, 0
 
@@ -60,17 +76,24 @@ async def main():
     blood = pg.image.load('Assets/Textures/blood0.png').convert_alpha()
     blood_size = np.asarray(blood.get_size())
     sky1 = hearts.copy() # initialize with something to adjust resol on start
+    ladder = ResolutionLadder(FOV)
+    ladder.set_sky(sky1)
+    sprite_cache = SpriteCache()
+    bands = RenderBands()
     msg = "Chemical X"
     surf = splash[0].copy()
     await splash_screen(msg, splash[0], clock, font, screen)
     msg = " "
     fps = 60
-    enable_floor = 1
+    governor = Governor()
+    levels = LevelLoader(level_textures, bundle)
+    levels.prepare(level, story) # while in the menu
+    resize, debug = 0, 0
 
     while running:
         pg.display.update()
         ticks = pg.time.get_ticks()/200
-        er = min(clock.tick()/500, 0.3)
+        er = min(clock.tick(render_fps)/500, 0.3)
         if not pause and (player_health <= 0 or (exit2 == 0  and int(posx) == exitx and int(posy) == exity)):
             msg = ' '
             if player_health <= 0:
@@ -105,6 +128,9 @@ async def main():
                 running = False
 
             if event.type == pg.KEYDOWN:
+                if event.key == pg.K_F3:
+                    debug = not debug
+
                 if event.key == ord('p') or event.key == pg.K_ESCAPE:
                     if not pause:
                         pause = 1
@@ -119,7 +145,7 @@ async def main():
             clock.tick(60)
 
             surf2, pause, options, running, newgame, adjust_res, m_vol, sfx_vol, story = pause_menu(
-                surf.copy(), menu, pause, options, click, running, m_vol, sfx_vol, sounds, newgame, font, msg, level, ticks, hres, story)
+                surf.copy(), menu, pause, options, click, running, m_vol, sfx_vol, sounds, newgame, font, msg, level, ticks, user_hres, story)
 
             screen.blit(surf2, (0,0))
             click = 0
@@ -136,71 +162,87 @@ async def main():
                     music = int(not(music))
                     sounds['music'+str(music)].play(-1)
 
-                msg = 'Loading...'
-                surf2 = surf.copy()
-                surf2.blit(font.render(msg, 1, (255, 255, 255)), (30, 500))
-                surf2.blit(font.render(msg, 1, (30, 255, 155)), (32, 502))
-                screen.blit(surf2, (0,0))
-                pg.display.update()
+                if not levels.ready(level, story):
+                    msg = 'Loading...'
+                    surf2 = surf.copy()
+                    surf2.blit(font.render(msg, 1, (255, 255, 255)), (30, 500))
+                    surf2.blit(font.render(msg, 1, (30, 255, 155)), (32, 502))
+                    screen.blit(surf2, (0,0))
+                    pg.display.update()
                 msg = 'Find the Chemical X!'
 
-                if story:
-                    posx, posy, rot, rotv, maph, mapc, exitx, exity, stepscount, size = load_map(level)
-                    nlevel = level_textures[level]
-
-                else:
-                    size = np.random.randint(10+level*2, 16+level*2)
-                    nenemies = size #number of enemies
-                    posx, posy, rot, rotv, maph, mapc, exitx, exity, stepscount = gen_map(size)
-                    nlevel = [np.random.randint(0,3), #sky1
-                              np.random.randint(0,4), #floorwall
-                              np.random.randint(0,3), #wall
-                              np.random.randint(0,2), #door
-                              np.random.randint(0,2), #window
-                              np.random.randint(0,5), #enemies
-                              ]
+                (posx, posy, rot, rotv, maph, mapc, exitx, exity, stepscount, size), nlevel, (sky1, floor, textures), sheets, enemies, \
+                    sightlines = await levels.get(level, story) # usually built while the last one was played
+                levels.prepare(level+1 if level < 5 else 0, story) # the next one, in case this one is cleared
 
                 nenemies = level**2 + 10 + level #number of enemies
-                sprites, spsize, sword, swordsp = get_sprites(nlevel[5])
-                sky1, floor, textures = load_textures(nlevel)
-                avg_floor = (np.mean(floor[:,:,0]),np.mean(floor[:,:,1]),np.mean(floor[:,:,2]))
-
-                sky = pg.transform.smoothscale(sky1, (12*hres*60/FOV, 3*halfvres*2))
-                enemies = spawn_enemies(nenemies, maph, size, posx, posy, level/2)
+                sprites, spsize, sword, swordsp = get_sprites(nlevel[5], bundle, sheets)
+                sky1 = pg.surfarray.make_surface(sky1).convert()
+                avg_floor = (np.mean(floor[0][:,:,0]),np.mean(floor[0][:,:,1]),np.mean(floor[0][:,:,2]))
+
+                ladder.set_sky(sky1)
+                hres, halfvres, mod, frame, half_frame, sky = ladder.get(hres)
+                ladder.prepare(hres, nearby_resolutions(user_hres, governor))
+                flow, grid, scheduler = FlowField(maph), EnemyGrid(enemies, size), AIScheduler()
+                lag, last, mape = 0, (posx, posy, rot, enemies.x.copy(), enemies.y.copy()), grid.near # state of the previous step, to draw in between
+                look = 0, 0
                 hearts2 = pg.Surface.subsurface(hearts,(0,0,max(1,player_health*10),20))
                 exit2, damage_mod, blood_scale = 1, 1, 1
-                mape, minimap = np.zeros((size, size)), np.zeros((size, size, 3))
+                minimap = np.zeros((size, size, 3))
                 sounds['healthup'].play()
 
+            governor.idle() # menus and loading are not frame time
+
         else:
-            timer = timer + er/2
+            start = governor.begin()
+            health = player_health
+            lag, look, taken = lag + er, np.add(look, pg.mouse.get_rel()), 0 # mouse moves wait for the next step
+            while lag >= step: # fixed steps whatever the frame rate
+                last = posx, posy, rot, enemies.x.copy(), enemies.y.copy()
+                timer, sim_ticks, taken = timer + step/2, sim_ticks + step*2.5, taken + 1
+                enemies, player_health, mape = enemies_ai(posx, posy, enemies, maph, size, grid, swordsp, sim_ticks, player_health, nenemies,
+                                                          level/3, governor['ai_rate'], sightlines, scheduler)
+                flow.update(posx, posy)
+                move_enemies(enemies, maph, step/3, flow)
+                posx, posy, rot, rotv = movement(pg.key.get_pressed(), look, posx, posy, rot, maph, step, rotv)
+                lag, look = lag - step, (0, 0) # turned by the first step only
+            start = governor.time('ai', start)
+
+            blend = lag/step # how far into the next step this frame is
+            viewx, viewy, viewrot = last[0] + (posx-last[0])*blend, last[1] + (posy-last[1])*blend, last[2] + (rot-last[2])*blend
+            movedx, movedy = enemies.x - last[3], enemies.y - last[4]
+            positions = (np.where(np.abs(movedx) < 1, last[3] + movedx*blend, enemies.x), # teleports are not slid
+                         np.where(np.abs(movedy) < 1, last[4] + movedy*blend, enemies.y))
+            camx, camy = viewx-0.2*np.cos(viewrot), viewy-0.2*np.sin(viewrot) # as seen by the sprites
 
             offset = -rotv*halfvres
-            if enable_floor > 1:
-                surf = floorcasting(posx, posy, rot, FOV, 1/mod, frame, floor, offset)
-            elif enable_floor == 1:
-                surf = floorcasting(posx, posy, rot, FOV, 2/mod, half_frame, floor, offset/2)
+            if governor['floor'] > 1:
+                surf = floorcasting(viewx, viewy, viewrot, FOV, 1/mod, frame, floor, offset, bands)
+            elif governor['floor'] == 1:
+                surf = floorcasting(viewx, viewy, viewrot, FOV, 2/mod, half_frame, floor, offset/2, bands)
                 surf = pg.transform.scale2x(surf)
             else:
                 surf = pg.surface.Surface((hres, halfvres*2))
                 surf.fill(avg_floor)
-            sub_sky = pg.Surface.subsurface(sky, (math.degrees(rot%(2*math.pi)*hres/FOV), halfvres*2-offset, hres, halfvres+offset))
+            sub_sky = pg.Surface.subsurface(sky, (math.degrees(viewrot%(2*math.pi)*hres/FOV), halfvres*2-offset, hres, halfvres+offset))
             surf.blit(sub_sky, (0, 0))
-            raycast_walls(surf, 1/mod, FOV, maph, posx, posy, rot, offset, textures, mapc)
+            start = governor.time('floor', start)
+            depth = raycast_walls(surf, 1/mod, FOV, maph, viewx, viewy, viewrot, offset, textures, mapc, bands) + 0.2 # as seen by the sprites
+            start = governor.time('walls', start)
 
-            mape = np.zeros((size, size))
-            health = player_health
-            enemies, player_health, mape = enemies_ai(posx, posy, enemies, maph, size, mape, swordsp, ticks, player_health, nenemies, level/3)
-            enemies = sort_sprites(posx-0.2*np.cos(rot), posy-0.2*np.sin(rot), rot, enemies, maph, size, er/3)
+            order = sort_sprites(camx, camy, viewrot, enemies, positions)
+            sprite_cache.step = governor['sprite_step']
             if exit2 == 0:
-                surf = draw_colonel(surf, colonel, posx-0.2*np.cos(rot), posy-0.2*np.sin(rot), exitx+0.5, exity+0.5,
-                                    hres, halfvres, rot, rotv, maph, size)
-            surf, en = draw_sprites(surf, sprites, enemies, spsize, hres, halfvres, ticks, sword, swordsp, rotv)
+                surf = draw_colonel(surf, colonel, camx, camy, exitx+0.5, exity+0.5,
+                                    hres, halfvres, viewrot, rotv, depth, sprite_cache)
+            surf, drawn = draw_sprites(surf, sprites, enemies, order, spsize, hres, halfvres, ticks, sword, swordsp, rotv, depth,
+                                       sprite_cache)
 
             if int(swordsp) > 0 and damage_mod < 1:
-                blood_scale = blood_scale*(1 + 2*er)
-                scaled_blood = pg.transform.scale(blood, 4*blood_scale*blood_size*hres/800)
-                surf.blit(scaled_blood, np.asarray([hres/2, halfvres]) - 2*blood_scale*blood_size*hres/800)
+                blood_scale = blood_scale*(1 + 2*step)**taken
+                scaled_blood = sprite_cache.get(blood, 4*blood_scale*blood_size*hres/800)
+                surf.blit(scaled_blood, np.asarray([hres/2, halfvres]) - np.asarray(scaled_blood.get_size())/2)
+            governor.time('sprites', start)
             #surf = pg.transform.scale2x(surf)
             surf = pg.transform.scale(surf, (800, 600))
             surf.blit(hearts2, (20,20))
@@ -214,6 +256,9 @@ async def main():
 
             surf.blit(font.render(str(round(timer,1)), 1, (255, 255, 255)), (20, 525))
             surf.blit(exits[exit2], (730,20))
+            if debug:
+                for i, line in enumerate(governor.readout() + scheduler.readout() + sprite_cache.readout()):
+                    surf.blit(debug_font.render(line, 1, (255, 255, 255)), (480, 80+20*i))
             screen.blit(surf, (0,0))
 
 
@@ -234,178 +279,135 @@ async def main():
 
             if int(swordsp) > 0:
                 if swordsp == 1:
-                    damage_mod = 1
-                    while enemies[en][3] < 10 and damage_mod > 0.4  and en >= 0:
-                        x = posx -0.2*np.cos(rot) + np.cos(rot + np.random.uniform(0, 0.05))/enemies[en][3]
-                        y = posy -0.2*np.sin(rot) + np.sin(rot + np.random.uniform(0, 0.05))/enemies[en][3]
-                        z = 0.5 + np.sin(rotv*-0.392699)/enemies[en][3]
-                        dist2en = np.sqrt((enemies[en][0]-x)**2 + (enemies[en][1]-y)**2)
-                        if dist2en < 0.1 and z > 0 and z < 0.07*enemies[en][5]:
-                            if z > 0.05*enemies[en][5]:
-                                enemies[en][8] = enemies[en][8] - np.random.uniform(0,2)*2
-                            else:
-                                enemies[en][8] = enemies[en][8] - np.random.uniform(0,2)
-
-                            enemies[en][10] = ticks
-                            x = enemies[en][0] + 0.1*np.cos(rot)
-                            y = enemies[en][1] + 0.1*np.sin(rot)
-                            if maph[int(x)][int(y)] == 0:
-                                enemies[en][0]= (x + enemies[en][0])/2 # push back
-                                enemies[en][1]= (y + enemies[en][1])/2
-                            if damage_mod == 1:
-                                blood_scale = enemies[en][3]
-                                sounds['swoosh'].play()
-                                if enemies[en][4]:
-                                    sounds['hitmonster2'].set_volume(min(1, enemies[en][3])*sfx_vol)
-                                    sounds['hitmonster2'].play()
-                                else:
-                                    sounds['hitmonster'].set_volume(min(1, enemies[en][3])*sfx_vol)
-                                    sounds['hitmonster'].play()
-                            damage_mod = damage_mod*0.5
-                            if enemies[en][8] < 0:
-                                sounds['deadmonster'].set_volume(min(1, enemies[en][3])*sfx_vol)
-                                sounds['deadmonster'].play()
-                                nenemies = nenemies - 1
-                                if nenemies == 0:
-                                    exit2, msg = 0, "Find Professor Utonium!"
-##                                if np.random.uniform(0,1) < 0.3:
-##                                    player_health = min(player_health+0.5, 20)
-##                                    hearts2 = pg.Surface.subsurface(hearts,(0,0,player_health*10,20))
-##                                    sounds['healthup'].play()
-                        en = en - 1
+                    targets = grid.cone(enemies, camx, camy, viewrot, 0.05, depth[hres//2], 0.1)
+                    hits = sword_hits(enemies, drawn[::-1][np.isin(drawn[::-1], targets)], camx, camy, viewrot, rotv, depth[hres//2],
+                                      sim_ticks, maph, positions) # nearest first, only those close to the aim
+                    damage_mod = 0.5**len(hits)
+                    if len(hits):
+                        en = hits[0]
+                        blood_scale = enemies.invdist[en]
+                        sounds['swoosh'].play()
+                        if enemies.type[en]:
+                            sounds['hitmonster2'].set_volume(min(1, enemies.invdist[en])*sfx_vol)
+                            sounds['hitmonster2'].play()
+                        else:
+                            sounds['hitmonster'].set_volume(min(1, enemies.invdist[en])*sfx_vol)
+                            sounds['hitmonster'].play()
+                    for en in hits:
+                        if not enemies.alive[en]:
+                            sounds['deadmonster'].set_volume(min(1, enemies.invdist[en])*sfx_vol)
+                            sounds['deadmonster'].play()
+                            nenemies = nenemies - 1
+                            if nenemies == 0:
+                                exit2, msg = 0, "Find Professor Utonium!"
+##                            if np.random.uniform(0,1) < 0.3:
+##                                player_health = min(player_health+0.5, 20)
+##                                hearts2 = pg.Surface.subsurface(hearts,(0,0,player_health*10,20))
+##                                sounds['healthup'].play()
 
                     if damage_mod == 1:
                         sounds['swoosh2'].play()
-                swordsp = (swordsp + er*10)%4
+                swordsp = (swordsp + taken*step*10)%4
 
             fps = int(clock.get_fps())
-            if fps < 20 and enable_floor > 0:
-                enable_floor -= 1
-
-            elif fps > 45 and enable_floor < 2:
-                enable_floor += 1
-
+            resize = governor.update()
 
-            #pg.display.set_caption("Health: "+str(round(player_health, 1))+" Enemies: " + str(nenemies) + " FPS: " + str(fps)+ ' '+str(enable_floor)+' '+ msg)
-            posx, posy, rot, rotv = movement(pg.key.get_pressed(), posx, posy, rot, maph, er, rotv)
+            #pg.display.set_caption("Health: "+str(round(player_health, 1))+" Enemies: " + str(nenemies) + " FPS: " + str(fps)+ ' '+str(governor['floor'])+' '+ msg + ' sprite cache: '+str(sprite_cache.hits)+'/'+str(sprite_cache.misses))
 ##            pg.mouse.set_pos(400,300)
-        if adjust_res != 1:
-            hres, halfvres, mod, frame, half_frame  = adjust_resolution(int(hres*adjust_res))
-            sky = pg.transform.smoothscale(sky1, (12*hres*60/FOV, 3*halfvres*2))
-            adjust_res = 1
+        if adjust_res != 1 or resize:
+            user_hres = resolution_step(int(user_hres*adjust_res))
+            hres, halfvres, mod, frame, half_frame, sky = ladder.get(int(user_hres*governor['res'])) # baked in the background
+            ladder.prepare(hres, nearby_resolutions(user_hres, governor))
+            adjust_res, resize = 1, 0
         await asyncio.sleep(0)
 
-def floorcasting(x_pos, y_pos, rot, FOV, mod, frame, floor, offset):
-    size = floor.shape
+def floorcasting(x_pos, y_pos, rot, FOV, mod, frame, floor, offset, bands):
+    size = floor[0].shape
     screen_size = frame.shape#screen.get_size()
     halfvres = int(screen_size[1]/2)
     hres = int(screen_size[0])
     n_pixels = int(halfvres - offset)
-    ns = halfvres/((halfvres - offset +0.1-np.linspace(0, halfvres- offset, n_pixels)))# depth
+    angles, depth, level = floor_tables(hres, halfvres, FOV, mod, halfvres - n_pixels)
 
-    for i in range(hres):
-        rot_i = rot + math.radians(i*mod - FOV*0.5)
-        sin, cos, cos2 = np.sin(rot_i), np.cos(rot_i), np.cos(rot_i-rot)
-        xs, ys = x_pos+ns*cos/cos2, y_pos+ns*sin/cos2
-        xxs, yys = ((50*xs)%size[0]).astype('int'), ((50*ys)%size[1]).astype('int')
-        frame[i][2*halfvres-n_pixels:] = floor[np.flip(xxs),np.flip(yys)]#* shade
+    mip = np.minimum(np.arange(16), len(floor)-1) # levels past the last mip reuse it
+    sizes = np.asarray([texture.shape[:2] for texture in floor])[mip]
+    starts = np.cumsum([0] + [len(texture)*len(texture[0]) for texture in floor])[mip]
+    texels = np.concatenate([texture.reshape(-1, 3) for texture in floor])
+    rot_i = rot + angles
+    cos, sin = (50*np.cos(rot_i)).astype(np.float32), (50*np.sin(rot_i)).astype(np.float32)
+    ratios = (sizes/size[:2]).astype(np.float32)
+    out = frame[:, 2*halfvres-n_pixels:]
 
-    return pg.surfarray.make_surface(frame)
+    def band(start, stop): # whole band of floor in one gather
+        kernels.cast_floor(out[start:stop], np.float32(50*x_pos), np.float32(50*y_pos), cos[start:stop], sin[start:stop],
+                           depth[start:stop], level[start:stop], texels, starts, sizes, ratios, np.float32(size[:2]))
 
-def raycast_walls(screen, mod, FOV, mapa, x_pos, y_pos, rot, offset, textures, mapc):
-    horizontal_res, vertical_res = screen.get_size()
-    # blit_list = []
-    for i in range(horizontal_res): #vision loop
-        rot_i = rot + math.radians(i*mod - FOV*0.5)
-        x1, y1, x2, y2, dist_near, dist_far = lodev_DDA(x_pos, y_pos, rot_i, mapa)
-        draw_wall_slice(x2, y2, dist_far, mod, FOV, textures, screen, mapc, mapa, vertical_res, offset, i, 3)
-        draw_wall_slice(x1, y1, dist_near, mod, FOV, textures, screen, mapc, mapa, vertical_res, offset, i)
-
-def draw_wall_slice(x, y, dist, mod, FOV, textures, screen, mapc, mapa, vertical_res, offset, i, shift=1):
-
-    texture = mapa[int(x)][int(y)] - 1
-    if texture > 2 and shift == 1:
-        texture = 1
-    else: texture = 2
-    text_coord = x%1
-    if text_coord < 0.001 or text_coord > 0.999:
-        text_coord = y%1
-    scale = int(vertical_res/max(0.2, dist*math.cos(math.radians(i*mod-FOV*0.5))))
-    color = mapc[int(x)][int(y)]
-    texture_size = textures[texture].get_size()
-    subsurface = pg.Surface.subsurface(textures[texture], (texture_size[0]*text_coord, 0, 1, texture_size[1]))
-    resized = pg.transform.smoothscale(subsurface, (1,scale))
-    tint = pygame.Surface((1,scale))
-    if x%1 > y%1:
-        try:
-            color = tuple(int(c) for c in color[:3])
-            color = tuple(max(0, min(255, c)) for c in color)
-        except Exception as e:
-            print("Bad color value:", color, "| Error:", e)
-            color = (0, 0, 0)
-
-    tint.fill(color)
-    tint.set_alpha(60)
-    resized.blit(tint, (0,0))
-    screen.blit(resized, (i, (vertical_res-shift*scale)*0.5+offset))
-
-def lodev_DDA(x, y, rot_i, mapa):
-    sizeX = len(mapa) - 1
-    sizeY = len(mapa[0]) - 1
-    sin, cos = math.sin(rot_i), math.cos(rot_i)
-    norm = math.sqrt(cos**2 + sin**2)
-    rayDirX, rayDirY = cos/norm + 1e-16, sin/norm + 1e-16
-    x1, y1, x2, y2, dist_near, dist_far = 0, 0, 0, 0, 999, 999
-
-    mapX, mapY = int(x), int(y)
-
-    deltaDistX, deltaDistY = abs(1/rayDirX), abs(1/rayDirY)
-
-    if rayDirX < 0:
-        stepX, sideDistX = -1, (x - mapX) * deltaDistX
-    else:
-        stepX, sideDistX = 1, (mapX + 1.0 - x) * deltaDistX
+    bands.run(hres, band)
 
-    if rayDirY < 0:
-        stepY, sideDistY = -1, (y - mapY) * deltaDistY
-    else:
-        stepY, sideDistY = 1, (mapY + 1 - y) * deltaDistY
-
-    for i in range(30):
-        if (sideDistX < sideDistY):
-            sideDistX += deltaDistX
-            mapX += stepX
-            dist = sideDistX
-            side = 0
-            if mapX < 0 or mapX > sizeX:
-                return x1, y1, x2, y2, dist_near, dist_far
-        else:
-            sideDistY += deltaDistY
-            mapY += stepY
-            dist = sideDistY
-            side = 1
-            if mapY < 0 or mapY > sizeY:
-                return x1, y1, x2, y2, dist_near, dist_far
-        if (mapa[mapX][mapY] > 0 and dist_near == 999) or mapa[mapX][mapY] > 2:
-            if side:
-                dist2 = dist - deltaDistY + 0.0001
-            else:
-                dist2 = dist - deltaDistX + 0.0001
-            if dist_near == 999:
-                dist_near = dist2
-                x1 = (x + rayDirX*dist_near)%sizeX
-                y1 = (y + rayDirY*dist_near)%sizeY
-            if mapa[mapX][mapY] > 2:
-                dist_far = dist2
-                x2 = (x + rayDirX*dist_far)%sizeX
-                y2 = (y + rayDirY*dist_far)%sizeY
-                break
+    return pg.surfarray.make_surface(frame)
+
+@functools.lru_cache(maxsize=32) # one entry per resolution and pitch step, least recently used goes first
+def floor_tables(hres, halfvres, FOV, mod, offset):
+    n_pixels = halfvres - offset
+    ns = halfvres/((halfvres - offset +0.1-np.linspace(0, halfvres- offset, n_pixels)))# depth
+    angles = np.radians(np.arange(hres)*mod - FOV*0.5)
+    depth = (np.flip(ns)/np.cos(angles)[:, None]).astype(np.float32) # per column, corrected for fisheye
+    footprint = 50*np.sqrt(depth*math.radians(mod)*np.abs(np.gradient(depth, axis=1))) # floor texels per pixel
+    level = np.clip(np.log2(np.maximum(footprint, 1)), 0, 15).astype(np.int8)
 
-    return x1, y1, x2, y2, dist_near, dist_far
+    return angles, depth, level
 
-def movement(pressed_keys, posx, posy, rot, maph, et, rotv):
+def raycast_walls(screen, mod, FOV, mapa, x_pos, y_pos, rot, offset, textures, mapc, bands):
+    horizontal_res, vertical_res = screen.get_size()
+    angles = np.radians(np.arange(horizontal_res)*mod - FOV*0.5)
+    rots, fisheye = rot + angles, np.cos(angles) # all rays at once
+    depth = np.empty(horizontal_res) # depth buffer, one wall distance per column
+
+    frame = pg.surfarray.pixels2d(screen) # writes go straight to the surface
+    shifts = [np.uint32(shift) for shift in screen.get_shifts()[:3]]
+
+    def band(start, stop):
+        x1, y1, x2, y2, dist_near, dist_far, side_near, side_far = kernels.lodev_DDA_rays(x_pos, y_pos, rots[start:stop], mapa)
+        draw_wall_columns(frame[start:stop], shifts, x2, y2, dist_far, fisheye[start:stop], textures, mapc, mapa, offset, 3)
+        draw_wall_columns(frame[start:stop], shifts, x1, y1, dist_near, fisheye[start:stop], textures, mapc, mapa, offset)
+        depth[start:stop] = dist_near
+
+    bands.run(horizontal_res, band)
+
+    return depth
+
+def draw_wall_columns(frame, shifts, x, y, dist, fisheye, textures, mapc, mapa, offset, shift=1):
+    hres, vres = frame.shape
+    scale = (vres/np.maximum(0.2, dist*fisheye)).astype(int)
+    cols = np.flatnonzero(scale > 0)
+    if len(cols) == 0:
+        return
+    cols = slice(cols[0], cols[-1]+1) # only the span of columns that hit something
+    x, y, scale = x[cols], y[cols], scale[cols] # 0 where the ray hit nothing or the wall is under a pixel, not drawn
+    top = ((vres-shift*scale)*0.5+offset).astype(int)
+    rows = slice(max(0, top.min()), min(vres, (top+scale).max()))
+    if rows.start >= rows.stop:
+        return
+
+    cells = x.astype(int), y.astype(int)
+    texture = np.where((mapa[cells] > 3) & (shift == 1), 1, 2)
+    text_coord = x%1
+    text_coord = np.where((text_coord < 0.001) | (text_coord > 0.999), y%1, text_coord)
+    texture_size = textures[0].shape[1:3]
+    level = np.clip(np.log2(texture_size[1]/np.maximum(scale, 1)).astype(int), 0, len(textures)-1) # texels per pixel picks the mip
+    heights = np.asarray([mip.shape[2] for mip in textures])[level]
+    strips = np.zeros((len(scale), texture_size[1], 3), np.uint16) # one texture column per ray
+    for l in np.unique(level):
+        cols_l = level == l
+        strips[cols_l, :heights[cols_l][0]] = textures[l][texture[cols_l], (textures[l].shape[1]*text_coord[cols_l]).astype(int)]
+    color = np.clip(mapc[cells], 0, 255).astype(np.uint16)[:, None]
+    strips = ((strips*np.uint16(196) + color*np.uint16(61)) >> np.uint16(8)).astype(np.uint32) # same as a 60 alpha tint blit
+    strips = strips[..., 0] << shifts[0] | strips[..., 1] << shifts[1] | strips[..., 2] << shifts[2]
+
+    kernels.sample_walls(frame[cols, rows], strips, top, scale, heights, rows.start)
+
+def movement(pressed_keys, p_mouse, posx, posy, rot, maph, et, rotv):
     x, y, diag = posx, posy, 0
-    p_mouse = pg.mouse.get_rel()
     if abs(p_mouse[0]) > 1:
         rot = rot + et*p_mouse[0]/20
     if abs(p_mouse[1]) > 1:
@@ -426,234 +428,226 @@ def movement(pressed_keys, posx, posy, rot, maph, et, rotv):
         et = et/(diag+1)
         x, y = x - et*np.sin(rot), y + et*np.cos(rot)
 
-    posx, posy = check_walls(posx, posy, maph, x, y)
+    posx, posy = kernels.check_walls(posx, posy, maph, x, y)
 
     return posx, posy, rot, rotv
 
-def gen_map(size):
-    mapc = np.random.randint(0, 257, (size, size, 3))
-    maph = np.random.choice([0, 0, 0, 0, 0, 0, 0, 0, 1, 2, 3, 4], (size,size))
-    maph[0,:] = np.random.choice([1, 2, 3, 4], size)
-    maph[size-1,:] = np.random.choice([1, 2, 3, 4], size)
-    maph[:,0] = np.random.choice([1, 2, 3, 4], size)
-    maph[:,size-1] = np.random.choice([1, 2, 3, 4], size)
-    posx, posy = np.random.randint(1, size -2)+0.5, np.random.randint(1, size -2)+0.5
+def gen_map(size, seed=None): # bounded time: one random walk carves the way, a flood fill keeps what it reaches
+    rng = np.random.default_rng(np.random.randint(2**31) if seed is None else seed) # follows np.random.seed when not given
+    mapc = rng.integers(0, 257, (size, size, 3))
+    maph = rng.choice([0, 0, 0, 0, 0, 0, 0, 0, 1, 2, 3, 4], (size,size))
+    maph[[0, size-1], :] = rng.choice([1, 2, 3, 4], (2, size))
+    maph[:, [0, size-1]] = rng.choice([1, 2, 3, 4], (size, 2))
+    posx, posy = rng.integers(1, size -2)+0.5, rng.integers(1, size -2)+0.5
     rot, rotv, stepscount = np.pi/4, 0, posx + posy
-    x, y = int(posx), int(posy)
-    maph[x][y] = 0
-    count = 0
-    while True:
-        testx, testy = (x, y)
-        if np.random.uniform() > 0.5:
-            testx = testx + np.random.choice([-1, 1])
-        else:
-            testy = testy + np.random.choice([-1, 1])
-        if testx > 0 and testx < size -1 and testy > 0 and testy < size -1:
-            if maph[testx][testy] == 0 or count > 5:
-                count = 0
-                x, y = (testx, testy)
-                maph[x][y] = 0
-                dtx = np.sqrt((x-posx)**2 + (y-posy)**2)
-                if (dtx > size*.6 and np.random.uniform() > .999) or np.random.uniform() > .99999:
-                    exitx, exity = (x, y)
-                    break
-            else:
-                count = count+1
 
-    return posx, posy, rot, rotv, maph, mapc, exitx, exity, stepscount
+    steps = size*size # random walk from the start, one cell up, down, left or right per step
+    sign = rng.choice([-1, 1], steps)
+    along_x = rng.uniform(size=steps) > 0.5
+    span = 2*(size - 3) # bounced off the border walls
+    x = (int(posx) - 1 + np.cumsum(np.where(along_x, sign, 0)))%span
+    y = (int(posy) - 1 + np.cumsum(np.where(along_x, 0, sign)))%span
+    x, y = np.where(x > size - 3, span - x, x) + 1, np.where(y > size - 3, span - y, y) + 1
+    maph[x, y] = 0
+    maph[int(posx), int(posy)] = 0
+
+    dist = grid_distances(maph == 0, (int(posx), int(posy)))
+    pockets = (maph == 0) & (dist < 0) # the walk never reached them
+    maph[pockets] = rng.choice([1, 2, 3, 4], pockets.sum())
+    far = np.flatnonzero(dist >= 0.9*dist.max()) # the exit goes among the farthest cells from the start
+    exitx, exity = np.unravel_index(rng.choice(far), (size, size))
+
+    return posx, posy, rot, rotv, maph, mapc, int(exitx), int(exity), stepscount
 
 def load_map(level):
-    mapc = pg.surfarray.array3d(pg.image.load('Assets/Levels/map'+str(level)+'.png'))
+    mapc, free, start, exit, blank = compile_level('Assets/Levels/map'+str(level)+'.png')
     size = len(mapc)
     maph = np.random.choice([1, 2, 3, 4], (size,size))
-    colors = np.asarray([[0,0,0], [255,255,255], [127,127,127]])
-    posx, exitx = None, None
-    for i in range(size):
-        for j in range(size):
-            color = mapc[i][j]
-            if (color == colors[0]).all() or (color == colors[1]).all() or (color == colors[2]).all():
-                maph[i][j] = 0
-                if (color == colors[1]).all():
-                    posx, posy = i+0.5, j+0.5
-                if (color == colors[2]).all():
-                    exitx, exity = i, j
-
-    while posx == None: # if no start is found
-        x, y = np.random.randint(1, size), np.random.randint(1, size)
-        if (mapc[x][y] == colors[0]).all():
-            posx, posy = x+0.5, y+0.5
-
-    while exitx == None: # if no exit is found
-        x, y = np.random.randint(1, size), np.random.randint(1, size)
-        if (mapc[x][y] == colors[0]).all():
-            exitx, exity = x, y
-
+    maph[free] = 0
+    if len(start) == 0: # if no start is found
+        start = blank[np.random.randint(len(blank))][None]
+    if len(exit) == 0: # if no exit is found
+        exit = blank[np.random.randint(len(blank))][None]
+    posx, posy = start[-1] + 0.5
+    exitx, exity = exit[-1]
     rot, rotv, stepscount = np.pi/4, 0, posx + posy
 
     return posx, posy, rot, rotv, maph, mapc, exitx, exity, stepscount, size
 
-def vision(posx, posy, enx, eny, dist2p, maph, size):
-    cos, sin = (posx-enx)/dist2p, (posy-eny)/dist2p
-    x, y = enx, eny
-    seen = 1
-    x, y = x +0.25*cos, y +0.25*sin
-    for i in range(abs(int((dist2p-0.5)/0.05))):
-        x, y = x +0.05*cos, y +0.05*sin
-        if (maph[int(x-0.02)%(size-1)][int(y-0.02)%(size-1)] or
-            maph[int(x-0.02)%(size-1)][int(y+0.02)%(size-1)] or
-            maph[int(x+0.02)%(size-1)][int(y-0.02)%(size-1)] or
-            maph[int(x+0.02)%(size-1)][int(y+0.02)%(size-1)]):
-            seen = 0
-            break
-    return seen
-
-def enemies_ai(posx, posy, enemies, maph, size, mape, swordsp, ticks, player_health, nenemies, level=0):
+def compile_level(path): # level png parsed once, cached beside it until the png changes
+    cache = os.path.join(os.path.dirname(path), '__pycache__', os.path.basename(path)[:-4] + '.npz')
+    mtime, digest = os.stat(path).st_mtime_ns, None
+    if os.path.exists(cache):
+        with np.load(cache) as level:
+            fields = [level[name] for name in ('mapc', 'free', 'start', 'exit', 'blank')]
+            if level['mtime'] == mtime:
+                return fields
+            digest = file_digest(path) # touched but maybe not changed
+            if level['digest'] == digest:
+                save_level(cache, fields, mtime, digest)
+                return fields
+
+    mapc = pg.surfarray.array3d(pg.image.load(path))
+    black, white, grey = [(mapc == color).all(2) for color in ([0,0,0], [255,255,255], [127,127,127])]
+    blank = np.argwhere(black)
+    fields = [mapc, black | white | grey, np.argwhere(white)[-1:], np.argwhere(grey)[-1:], # the last marked one wins
+              blank[(blank > 0).all(1)]] # to pick a start or exit when none is marked
+    save_level(cache, fields, mtime, digest or file_digest(path))
+    return fields
+
+def file_digest(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def save_level(cache, fields, mtime, digest):
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        np.savez(cache + '.tmp.npz', mapc=fields[0], free=fields[1], start=fields[2], exit=fields[3], blank=fields[4],
+                 mtime=mtime, digest=digest)
+        os.replace(cache + '.tmp.npz', cache) # never half written
+    except OSError: # read only assets, parse every time
+        pass
+
+def enemies_ai(posx, posy, enemies, maph, size, grid, swordsp, ticks, player_health, nenemies, level=0, rate=0.1, sightlines=None,
+               scheduler=None):
+    alive = enemies.alive
     if nenemies < 5: # teleport far enemies closer
-        for en in range(len(enemies)): # mape = enemies heatmap
-            if enemies[en][8] > 0:
-                enx, eny =  enemies[en][0], enemies[en][1]
-                dist2p = np.sqrt((enx-posx)**2 + (eny-posy)**2 + 1e-16)
-                if dist2p > 10:
-                    for i in range(10):
-                        x, y = np.random.randint(1, size), np.random.randint(1, size)
-                        dist2p = np.sqrt((x+0.5-posx)**2 + (y+0.5-posy)**2 + 1e-16)
-                        if dist2p > 6 and dist2p < 8 and maph[x][y] == 0:
-                            enemies[en][0], enemies[en][1] = x + 0.5, y + 0.5
-                            break
-
-    for en in range(len(enemies)): # mape = enemies heatmap
-        if enemies[en][8] > 0:
-            x, y = int(enemies[en][0]), int(enemies[en][1])
-            mape[x-1:x+2, y-1:y+2] = mape[x-1:x+2, y-1:y+2] + 1
-
-    for en in range(len(enemies)):
-        if enemies[en][8] > 0 and np.random.uniform(0,1) < 0.1: # update only % of the time
-            enx, eny, angle =  enemies[en][0], enemies[en][1], enemies[en][6]
-            health, state, cooldown = enemies[en][8], enemies[en][9], enemies[en][10]
-            dist2p = np.sqrt((enx-posx)**2 + (eny-posy)**2 + 1e-16)
-
-            friends = mape[int(enx)][int(eny)] - 1
-            if dist2p > 1.42: # add friends near the player if not too close
-                friends = friends + mape[int(posx)][int(posy)]
-
-            not_afraid = 0
-            # zombies are less afraid
-            if  health > 1 + enemies[en][4] - level or health + friends > 3 + enemies[en][4] - level:
-                not_afraid = 1
-
-            if state == 0 and dist2p < 6:  # normal
-                angle = angle2p(enx, eny, posx, posy)
-                angle2 = (enemies[en][6]-angle)%(2*np.pi)
-                if angle2 > 11*np.pi/6 or angle2 < np.pi/6 or (swordsp >= 1 and dist2p < 3): # in fov or heard
-                    if vision(posx, posy, enx, eny, dist2p, maph, size):
-                        if not_afraid and ticks - cooldown > 5:
-                            state = 1 # turn aggressive
-                        elif dist2p < 2:
-                            state = 2 # retreat
-                            angle = angle - np.pi
-                    else:
-                        angle = enemies[en][6] # revert to original angle
-
-            elif state == 1: # aggressive
-                if dist2p < 0.8 and ticks - cooldown > 10: # perform attack, 2s cooldown
-                    enemies[en][10] = ticks # reset cooldown, damage is lower with more enemies on same cell
-                    player_health = player_health - np.random.uniform(0.5, 1 + level/2)/np.sqrt(1+mape[int(posx)][int(posy)])
-                    state = 2
-                if not_afraid: # turn to player
-                    angle = angle2p(enx, eny, posx, posy)
-                else: # retreat
-                    state = 2
-
-            elif state == 2: # defensive
-                if not_afraid and ticks - cooldown > 5:
-                    state = 0
-                else:
-                    angle = angle2p(posx, posy, enx, eny) + np.random.uniform(-0.5, 0.5) #turn around
-
-            enemies[en][6], enemies[en][9]  = angle+ np.random.uniform(-0.2, 0.2), state
+        far = np.flatnonzero(alive & (np.sqrt((enemies.x-posx)**2 + (enemies.y-posy)**2 + 1e-16) > 10))
+        x, y = np.random.randint(1, size, (2, len(far), 10)) # ten tries each
+        dist2p = np.sqrt((x+0.5-posx)**2 + (y+0.5-posy)**2 + 1e-16)
+        found = (dist2p > 6) & (dist2p < 8) & (maph[x, y] == 0)
+        moved, first = found.any(1), found.argmax(1)
+        enemies.x[far[moved]], enemies.y[far[moved]] = x[moved, first[moved]] + 0.5, y[moved, first[moved]] + 0.5
+
+    grid.update(enemies)
+    mape = grid.near # enemies heatmap
+
+    if scheduler is None:
+        en = np.flatnonzero(alive & (np.random.uniform(0, 1, len(enemies)) < rate)) # update only % of the time
+    else:
+        en = scheduler.pick(enemies, posx, posy, rate)
+    enx, eny, angle, types = enemies.x[en], enemies.y[en], enemies.direction[en], enemies.type[en]
+    health, state, cooldown = enemies.health[en], enemies.state[en], enemies.cooldown[en]
+    dist2p = np.sqrt((enx-posx)**2 + (eny-posy)**2 + 1e-16)
+    crowd = mape[int(posx)][int(posy)]
+
+    friends = mape[enx.astype(int), eny.astype(int)] - 1 + (dist2p > 1.42)*crowd # add friends near the player if not too close
+    # zombies are less afraid
+    not_afraid = (health > 1 + types - level) | (health + friends > 3 + types - level)
+    to_player = kernels.angles2p(enx, eny, posx, posy)
+    new_state = state.copy()
+
+    normal = (state == 0) & (dist2p < 6)
+    angle2 = (angle-to_player)%(2*np.pi)
+    noticed = normal & ((angle2 > 11*np.pi/6) | (angle2 < np.pi/6) | ((swordsp >= 1) & (dist2p < 3))) # in fov or heard
+    seen = noticed.copy()
+    if sightlines is None:
+        seen[noticed] = kernels.visions(posx, posy, enx[noticed], eny[noticed], dist2p[noticed], maph, size)
+    else:
+        seen[noticed] = sightlines.visible(posx, posy, enx[noticed], eny[noticed], dist2p[noticed])
+    aggressive = seen & not_afraid & (ticks - cooldown > 5)
+    retreat = seen & ~aggressive & (dist2p < 2)
+    new_state[aggressive], new_state[retreat] = 1, 2
+    new_angle = np.where(normal & (seen | ~noticed), to_player, angle) # unseen keeps the original angle
+    new_angle[retreat] -= np.pi
+
+    attacking = state == 1
+    attack = attacking & (dist2p < 0.8) & (ticks - cooldown > 10) # perform attack, 2s cooldown
+    enemies.cooldown[en[attack]] = ticks # reset cooldown, damage is lower with more enemies on same cell
+    player_health = player_health - np.sum(np.random.uniform(0.5, 1 + level/2, attack.sum())/np.sqrt(1+crowd))
+    new_state[attacking & (attack | ~not_afraid)] = 2 # retreat after attacking or when afraid
+    new_angle[attacking & not_afraid] = to_player[attacking & not_afraid] # turn to player
+
+    defensive = state == 2
+    calm = defensive & not_afraid & (ticks - cooldown > 5)
+    turn = defensive & ~calm
+    new_state[calm] = 0
+    new_angle[turn] = kernels.angles2p(posx, posy, enx[turn], eny[turn]) + np.random.uniform(-0.5, 0.5, turn.sum()) #turn around
+
+    enemies.direction[en], enemies.state[en] = new_angle + np.random.uniform(-0.2, 0.2, len(en)), new_state
 
     return enemies, player_health, mape
 
-def check_walls(posx, posy, maph, x, y): # for walking
-    if not(maph[int(x-0.2)][int(y)] or maph[int(x+0.2)][int(y)] or #check all sides
-           maph[int(x)][int(y-0.2)] or maph[int(x)][int(y+0.2)]):
-        posx, posy = x, y
-
-    elif not(maph[int(posx-0.2)][int(y)] or maph[int(posx+0.2)][int(y)] or # move only in y
-             maph[int(posx)][int(y-0.2)] or maph[int(posx)][int(y+0.2)]):
-        posy = y
-
-    elif not(maph[int(x-0.2)][int(posy)] or maph[int(x+0.2)][int(posy)] or # move only in x
-             maph[int(x)][int(posy-0.2)] or maph[int(x)][int(posy+0.2)]):
-        posx = x
-
-    return posx, posy
-
-def angle2p(posx, posy, enx, eny):
-    angle = np.arctan((eny-posy)/(enx-posx+1e-16))
-    if abs(posx+np.cos(angle)-enx) > abs(posx-enx):
-        angle = (angle - np.pi)%(2*np.pi)
-    return angle
-
-def sort_sprites(posx, posy, rot, enemies, maph, size, er):
-    for en in range(len(enemies)):
-        enemies[en][3] = 9999
-        if enemies[en][8] > 0: # dont bother with the dead
-            enx, eny = enemies[en][0], enemies[en][1]
-            backstep = 1
-            if enemies[en][9] == 1 and enemies[en][3] > 1.7 and enemies[en][3] < 10:
-                backstep = -1 # avoid going closer than necessary to the player
-            speed = backstep*er*(2+enemies[en][9]/2)
-            cos, sin = speed*np.cos(enemies[en][6]), speed*np.sin(enemies[en][6])
-            x, y = enx+cos, eny+sin
-            enx, eny = check_walls(enx, eny, maph, x, y)
-            if enx == enemies[en][0] and eny == enemies[en][1]:
-                x, y = enx-cos, eny-sin
-                enx, eny = check_walls(enx, eny, maph, x, y)
-                if enx == enemies[en][0] and eny == enemies[en][1]:
-                    if maph[int(x)][int(y)] == 0:
-                        enx, eny = x, y
-            if enx == enemies[en][0] or eny == enemies[en][1]: #check colisions
-                enemies[en][6] = enemies[en][6] + np.random.uniform(-0.5, 0.5)
-                if np.random.uniform(0,1) < 0.01:
-                    enemies[en][9] = 0 # return to normal state
-            enemies[en][0], enemies[en][1] = enx, eny
-
-            angle = angle2p(posx, posy, enx, eny)
-            angle2= (rot-angle)%(2*np.pi)
-            if angle2 > 10.5*np.pi/6 or angle2 < 1.5*np.pi/6:
-                dir2p = ((enemies[en][6] - angle -3*np.pi/4)%(2*np.pi))/(np.pi/2)
-                dist2p = np.sqrt((enx-posx)**2+(eny-posy)**2+1e-16)
-                enemies[en][2] = angle2
-                enemies[en][7] = dir2p
-                if vision(enx, eny, posx, posy, dist2p, maph, size):
-                    enemies[en][3] = 1/dist2p
-
-    enemies = enemies[enemies[:, 3].argsort()]
-    return enemies
+def move_enemies(enemies, maph, er, flow=None): # one step for all the living
+    en = enemies.ids # dont bother with the dead
+    if flow is not None: # aggressive ones follow the shortest path, straight at the player once next to it
+        chase = en[enemies.state[en] == 1]
+        heading, far = flow.heading(enemies.x[chase], enemies.y[chase])
+        enemies.direction[chase[far]] = heading[far]
+    enx, eny = enemies.x[en], enemies.y[en]
+    speed = er*(2+enemies.state[en]/2)
+    cos, sin = speed*np.cos(enemies.direction[en]), speed*np.sin(enemies.direction[en])
+    x, y = kernels.check_walls_many(enx, eny, maph, enx+cos, eny+sin)
+    stuck = (x == enx) & (y == eny)
+    backx, backy = kernels.check_walls_many(enx, eny, maph, enx-cos, eny-sin) # try backwards
+    back = stuck & ((backx != enx) | (backy != eny))
+    back_free = stuck & ~back & (maph[(enx-cos).astype(int), (eny-sin).astype(int)] == 0)
+    x, y = np.where(back, backx, np.where(back_free, enx-cos, x)), np.where(back, backy, np.where(back_free, eny-sin, y))
+
+    hit = (x == enx) | (y == eny) #check colisions
+    enemies.direction[en[hit]] += np.random.uniform(-0.5, 0.5, hit.sum())
+    enemies.state[en[hit & (np.random.uniform(0, 1, len(en)) < 0.01)]] = 0 # return to normal state
+    enemies.x[en], enemies.y[en] = x, y
+
+def sort_sprites(posx, posy, rot, enemies, positions=None): # the living in view, far to near
+    x, y = (enemies.x, enemies.y) if positions is None else positions # where they are drawn, between two steps
+    enemies.invdist[:] = 9999 # out of view
+    en = enemies.ids
+    x, y = x[en], y[en]
+    angle = kernels.angles2p(posx, posy, x, y)
+    angle2 = (rot-angle)%(2*np.pi)
+    seen = (angle2 > 10.5*np.pi/6) | (angle2 < 1.5*np.pi/6)
+    en, angle, angle2, x, y = en[seen], angle[seen], angle2[seen], x[seen], y[seen]
+    enemies.dir2p[en] = ((enemies.direction[en] - angle -3*np.pi/4)%(2*np.pi))//(np.pi/2)%4
+    enemies.angle2p[en] = angle2
+    enemies.invdist[en] = 1/np.sqrt((x-posx)**2+(y-posy)**2+1e-16) # walls are clipped against the depth buffer when drawing
+    enemies.order = en[np.argsort(enemies.invdist[en], kind='stable')]
+
+    return enemies.order
+
+def sword_hits(enemies, candidates, posx, posy, rot, rotv, reach, ticks, maph, positions=None, most=2):
+    # returns who was hit, nearest first: the blade halves its damage per hit and stops past 0.4, after two
+    enx, eny = (enemies.x, enemies.y) if positions is None else positions
+    en = np.asarray(candidates, int) # nearest first
+    dist = 1/enemies.invdist[en].astype(float)
+    jitter = rot + np.random.uniform(0, 0.05, (2, len(en)))
+    x, y = posx + np.cos(jitter[0])*dist, posy + np.sin(jitter[1])*dist # where the aim is at their distance
+    z = 0.5 + np.sin(rotv*-0.392699)*dist
+    dist2en = np.sqrt((enx[en]-x)**2 + (eny[en]-y)**2)
+    hit = (dist2en < 0.1) & (z > 0) & (z < 0.07*enemies.size[en]) & (dist < reach) # not behind a wall
+    en, z = en[hit][:most], z[hit][:most]
+
+    head = z > 0.05*enemies.size[en]
+    enemies.health[en] -= np.random.uniform(0, 2, len(en))*np.where(head, 2, 1)
+    enemies.cooldown[en] = ticks
+    x, y = enemies.x[en] + 0.1*np.cos(rot), enemies.y[en] + 0.1*np.sin(rot)
+    free = maph[x.astype(int), y.astype(int)] == 0
+    enemies.x[en[free]] = (x[free] + enemies.x[en[free]])/2 # push back
+    enemies.y[en[free]] = (y[free] + enemies.y[en[free]])/2
+    for dead in en[enemies.health[en] <= 0]:
+        enemies.kill(dead)
+
+    return en
 
 def spawn_enemies(number, maph, msize, posx, posy, level=0):
-    enemies = []
+    enemies = EnemyStore(number)
     for i in range(number):
         x, y = np.random.randint(1, msize-2), np.random.randint(1, msize-2)
         while maph[x][y] or (x == int(posx) and y == int(posy)):
             x, y = np.random.randint(1, msize-2), np.random.randint(1, msize-2)
         x, y = x+0.5, y+0.5
-        angle2p, invdist2p, dir2p = 0, 1, 0 # angle, inv dist, dir2p relative to player
         entype = np.random.choice([0,1]) # 0 zombie, 1 skeleton
         direction = np.random.uniform(0, 2*np.pi) # facing direction
         size = np.random.uniform(7, 10)
         health = size/2 + level/3
         state = np.random.randint(0,3) # 0 normal, 1 aggressive, 2 defensive
-        cooldown = 0 # atack cooldown
- #                       0, 1,       2,         3,      4,    5,         6,     7,      8,     9,       10
-        enemies.append([x, y, angle2p, invdist2p, entype, size, direction, dir2p, health, state, cooldown])
-    return np.asarray(enemies)
+        enemies.spawn(x=x, y=y, type=entype, size=size, direction=direction, health=health, state=state)
+    return enemies
 
-def get_sprites(level):
-    sheet = pg.image.load('Assets/Sprites/zombie_n_skeleton' + str(level) + '.png').convert_alpha()
+def get_sprites(level, bundle=None, sheets=None): # sheets are the two sprite_sheet() already loaded, if any
+    sheet, swordsheet = sheets or (sprite_sheet('zombie_n_skeleton' + str(level), bundle), sprite_sheet('gun2', bundle))
+    sheet, swordsheet = sheet.convert_alpha(), swordsheet.convert_alpha()
     sprites = [[], []]
-    swordsheet = pg.image.load('Assets/Sprites/gun2.png').convert_alpha()
     sword = []
     for i in range(3):
         sword.append(pg.Surface.subsurface(swordsheet,(i*800,0,800,600)))
@@ -672,6 +666,16 @@ def get_sprites(level):
 
     return sprites, spsize, sword, swordsp
 
+def sprite_sheet(name, bundle=None): # decoded only, get_sprites converts it for the display
+    pixels = sprite_pixels(name, bundle)
+    return pg.image.frombuffer(pixels, pixels.shape[1::-1], 'RGBA')
+
+def sprite_pixels(name, bundle=None): # rows of RGBA
+    if bundle is not None and 'Sprites/'+name in bundle:
+        return bundle['Sprites/'+name]
+    image = pg.image.load('Assets/Sprites/'+name+'.png')
+    return np.frombuffer(pg.image.tobytes(image, 'RGBA'), np.uint8).reshape(image.get_height(), image.get_width(), 4)
+
 def apply_colorkey(path, colorkey=(55,55,55)):
     image = pg.image.load(path)
     new_image = image.copy()
@@ -681,67 +685,584 @@ def apply_colorkey(path, colorkey=(55,55,55)):
 
     return new_image
 
-def draw_sprites(surf, sprites, enemies, spsize, hres, halfvres, ticks, sword, swordsp, rotv):
-    #enemies : x, y, angle2p, dist2p, type, size, direction, dir2p
+def draw_sprites(surf, sprites, enemies, order, spsize, hres, halfvres, ticks, sword, swordsp, rotv, depth, sprite_cache):
     offset = int(rotv*halfvres)
     cycle = int(ticks)%3 # animation cycle for monsters
-    for en in range(len(enemies)):
-        if enemies[en][3] >  10:
-            break
-        types, dir2p = int(enemies[en][4]), int(enemies[en][7])
-        cos2 = np.cos(enemies[en][2])
-        scale = min(enemies[en][3], 2)*spsize*enemies[en][5]/cos2*hres/800
-        vert = halfvres + halfvres*min(enemies[en][3], 2)/cos2 - offset
-        hor = hres/2 - hres*np.sin(enemies[en][2])
-        #if enemies[en][3] > 0.333:
-        spsurf = pg.transform.scale(sprites[types][cycle][dir2p], scale)
-        #else:
-        #    spsurf = pg.transform.smoothscale(sprites[types][cycle][dir2p], scale)
-        surf.blit(spsurf, (hor,vert)-scale)
+    drawn = order[enemies.invdist[order] <= 10] # far to near
+    for en in drawn:
+        types, dir2p, invdist = enemies.type[en], enemies.dir2p[en], enemies.invdist[en]
+        cos2 = np.cos(enemies.angle2p[en])
+        scale = min(invdist, 2)*spsize*enemies.size[en]/cos2*hres/800
+        vert = halfvres + halfvres*min(invdist, 2)/cos2 - offset
+        hor = hres/2 - hres*np.sin(enemies.angle2p[en])
+        spsurf = sprite_cache.get(sprites[types][cycle][dir2p], scale) # never filtered, only the colonel is when far
+        blit_occluded(surf, spsurf, (hor,vert)-np.asarray(spsurf.get_size()), 1/invdist, depth)
 
     swordpos = (np.sin(ticks)*10*hres/800,(np.cos(ticks)*10+15)*hres/800) # sword shake
-    spsurf = pg.transform.scale(sword[int(swordsp)], (hres, halfvres*2))
+    spsurf = sprite_cache.get(sword[int(swordsp)], (hres, halfvres*2), exact=1)
     surf.blit(spsurf, swordpos)
 
-    return surf, en-1
+    return surf, drawn
 
-def draw_colonel(surf, colonel, posx, posy, enx, eny, hres, halfvres, rot, rotv, maph, size):
-    angle = angle2p(posx, posy, enx, eny)
+def draw_colonel(surf, colonel, posx, posy, enx, eny, hres, halfvres, rot, rotv, depth, sprite_cache):
+    angle = kernels.angle2p(posx, posy, enx, eny)
     angle2= (rot-angle)%(2*np.pi)
     if angle2 > 10.5*np.pi/6 or angle2 < 1.5*np.pi/6:
         dist2p = np.sqrt((enx-posx)**2+(eny-posy)**2+1e-16)
-        if vision(enx, eny, posx, posy, dist2p, maph, size):
-            offset = int(rotv*halfvres)
-            cos2 = np.cos(angle2)
-            spsize = np.asarray(colonel.get_size())
-            scale = min(1/dist2p, 2)*spsize*6/cos2*hres/800
-            vert = halfvres + halfvres*min(1/dist2p, 2)/cos2 - offset
-            hor = hres/2 - hres*np.sin(angle2)
-            if dist2p < 3:
-                spsurf = pg.transform.scale(colonel, scale)
-            else:
-                spsurf = pg.transform.smoothscale(colonel, scale)
-            surf.blit(spsurf, (hor,vert)-scale/2)
+        offset = int(rotv*halfvres)
+        cos2 = np.cos(angle2)
+        spsize = np.asarray(colonel.get_size())
+        scale = min(1/dist2p, 2)*spsize*6/cos2*hres/800
+        vert = halfvres + halfvres*min(1/dist2p, 2)/cos2 - offset
+        hor = hres/2 - hres*np.sin(angle2)
+        spsurf = sprite_cache.get(colonel, scale, smooth=dist2p >= 3)
+        blit_occluded(surf, spsurf, (hor,vert)-np.asarray(spsurf.get_size())/2, dist2p, depth)
     return surf
 
-def load_sounds():
-    sounds = {}
-    sounds['step'] = pg.mixer.Sound('Assets/Sounds/playerstep.ogg')
-    sounds['step2'] = pg.mixer.Sound('Assets/Sounds/enemystep.ogg')
-    sounds['swoosh'] = pg.mixer.Sound('Assets/Sounds/gun.ogg')
-    sounds['swoosh2'] = pg.mixer.Sound('Assets/Sounds/gun2.ogg')
-    sounds['hurt'] = pg.mixer.Sound('Assets/Sounds/damage.ogg')
-    sounds['deadmonster'] = pg.mixer.Sound('Assets/Sounds/deadmonster.ogg')
-    sounds['hitmonster'] = pg.mixer.Sound('Assets/Sounds/hitmonster.ogg')
-    sounds['hitmonster2'] = pg.mixer.Sound('Assets/Sounds/hitmonster2.ogg')
-    sounds['healthup'] = pg.mixer.Sound('Assets/Sounds/healthup.ogg')
-    sounds['died'] = pg.mixer.Sound('Assets/Sounds/died.ogg')
-    sounds['won'] = pg.mixer.Sound('Assets/Sounds/won.ogg')
-    sounds['music0'] = pg.mixer.Sound('Assets/Sounds/battlemusic0.ogg')
-    sounds['music1'] = pg.mixer.Sound('Assets/Sounds/battlemusic1.ogg')
+class SpriteCache: # scaled sprites per source image and size bucket, least recently used dropped first
+    def __init__(self, max_bytes=64*2**20, step=0.05): # a coarser step rescales less often, the Governor sets it
+        self.surfs, self.nbytes, self.max_bytes, self.step = OrderedDict(), 0, max_bytes, step
+        self.hits, self.misses = 0, 0 # to tune the bucket step
+
+    def get(self, image, size, smooth=0, exact=0):
+        if exact:
+            key = (image, smooth, int(size[0]), int(size[1]))
+        else: # geometric height buckets, the width keeps the image aspect
+            bucket = round(math.log(max(size[1], 1))/math.log(1 + self.step))
+            key = (image, smooth, self.step, bucket)
+            height = (1 + self.step)**bucket
+            size = image.get_width()*height/image.get_height(), height
+        if key in self.surfs:
+            self.hits += 1
+            self.surfs.move_to_end(key)
+            return self.surfs[key]
+
+        self.misses += 1
+        size = max(1, int(size[0])), max(1, int(size[1]))
+        surf = pg.transform.smoothscale(image, size) if smooth else pg.transform.scale(image, size)
+        self.surfs[key] = surf
+        self.nbytes += size[0]*size[1]*surf.get_bytesize()
+        while self.nbytes > self.max_bytes and len(self.surfs) > 1:
+            old = self.surfs.popitem(last=False)[1]
+            self.nbytes -= old.get_width()*old.get_height()*old.get_bytesize()
+        return surf
+
+    def readout(self): # to tune the bucket step
+        return ['sprite cache hits/misses '+str(self.hits)+'/'+str(self.misses), 'sprite cache '+str(round(self.nbytes/2**20, 1))+' MB']
+
+class RenderBands: # vertical column bands of the frame, drawn by a pool of threads straight into the shared buffer
+    def __init__(self, workers=int(os.environ.get('DEAD_END_WORKERS', os.cpu_count() or 1))):
+        self.workers = max(1, workers)
+        self.pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+    def run(self, width, work): # work(start, stop) draws columns start:stop, bands never overlap
+        if self.pool is None or width < 2*self.workers:
+            work(0, width)
+            return
+        edges = np.linspace(0, width, self.workers+1).astype(int)
+        futures = []
+        for start, stop in zip(edges[:-1], edges[1:]):
+            if self.pool is not None:
+                try:
+                    futures.append(self.pool.submit(work, start, stop))
+                    continue
+                except RuntimeError: # no threads on this platform, the rest of the bands are drawn here
+                    self.pool = None
+            work(start, stop)
+        for future in futures:
+            future.result() # also raises whatever went wrong in the band
+
+class Governor: # keeps frames within a time budget by lowering quality where the time goes, with hysteresis
+    ladders = {'floor': [2, 1, 0], 'res': [1, 0.9, 0.8, 0.7, 0.6, 0.5], 'sprite_step': [0.05, 0.1, 0.2], 'ai_rate': [0.1, 0.05, 0.025]}
+    knobs = {'floor': ['floor', 'res'], 'walls': ['res'], 'ai': ['ai_rate'], 'sprites': ['sprite_step', 'res']} # per stage
+
+    def __init__(self, fps=30, patience=15):
+        self.budget, self.patience, self.wait = 1/fps, patience, 4*patience
+        self.level = dict.fromkeys(self.ladders, 0) # 0 is full quality
+        self.times, self.frame = dict.fromkeys(self.knobs, 0.0), 0.0 # smoothed seconds
+        self.over, self.under, self.since_up = 0, 0, self.wait
+        self.lowered, self.last = [], 'full quality'
+        self.start = time.perf_counter()
+
+    def __getitem__(self, knob):
+        return self.ladders[knob][self.level[knob]]
+
+    def time(self, stage, start): # start is perf_counter() before the stage, returns it for the next one
+        now = time.perf_counter()
+        self.times[stage] += 0.1*(now - start - self.times[stage])
+        return now
+
+    def idle(self):
+        self.start = time.perf_counter()
+
+    def begin(self): # the frame's work starts here, waiting in clock.tick for a capped frame rate is not frame time
+        self.start = time.perf_counter()
+        return self.start
+
+    def update(self): # once per rendered frame after begin(), True when the resolution has to change
+        now = time.perf_counter()
+        self.frame += 0.1*(now - self.start - self.frame)
+        self.start = now
+        self.over = self.over + 1 if self.frame > self.budget else 0
+        self.under = self.under + 1 if self.frame < 0.6*self.budget else 0 # the gap between both keeps it steady
+        self.since_up += 1
+
+        if self.over > self.patience:
+            if self.since_up < self.wait: # going up did not hold, wait longer next time
+                self.wait = min(2*self.wait, 64*self.patience)
+            for stage in sorted(self.times, key=self.times.get, reverse=True):
+                for knob in self.knobs[stage]:
+                    if self.level[knob] < len(self.ladders[knob]) - 1:
+                        self.level[knob] += 1
+                        self.lowered.append(knob)
+                        self.over, self.under, self.last = 0, 0, stage + ': ' + knob + ' down'
+                        return knob == 'res'
+
+        elif self.under > self.wait and self.lowered:
+            knob = self.lowered.pop() # undo the last step first
+            self.level[knob] -= 1
+            self.over, self.under, self.since_up, self.last = 0, 0, 0, knob + ' up'
+            return knob == 'res'
+
+        return False
+
+    def readout(self):
+        return (['frame '+str(round(1000*self.frame, 1))+' / '+str(round(1000*self.budget, 1))+' ms'] +
+                [stage+' '+str(round(1000*self.times[stage], 1))+' ms' for stage in self.times] +
+                [knob+' = '+str(self[knob]) for knob in self.ladders] + [self.last])
+
+class ResolutionLadder: # buffers, sky and floor tables of the nearby resolutions, baked in the background ahead of time
+    def __init__(self, FOV):
+        self.FOV, self.sky1, self.steps = FOV, None, {}
+        self.pool = ThreadPoolExecutor(1)
+
+    def set_sky(self, sky1): # new level, every step needs its sky scaled again
+        self.sky1, self.steps = sky1, {}
+
+    def bake(self, hres, sky1):
+        hres, halfvres, mod, frame, half_frame = adjust_resolution(hres)
+        sky = pg.transform.smoothscale(sky1, (12*hres*60/self.FOV, 3*halfvres*2))
+        floor_tables(hres, halfvres, self.FOV, 1/mod, 0) # level view, for both floor modes
+        floor_tables(hres//2, halfvres//2, self.FOV, 2/mod, 0)
+        return hres, halfvres, mod, frame, half_frame, sky
+
+    def prepare(self, hres, nearby): # keeps the current step, starts baking the nearby ones, drops the rest
+        keep = {resolution_step(step) for step in [hres] + nearby}
+        self.steps = {step: baked for step, baked in self.steps.items() if step in keep}
+        for step in keep - self.steps.keys():
+            future = self.submit(step)
+            if future is None: # no threads, the steps are baked when asked for
+                break
+            self.steps[step] = future
+
+    def get(self, hres): # waits only if that step was not prepared
+        step = resolution_step(hres)
+        if step not in self.steps:
+            self.steps[step] = self.submit(step) or self.baked(step)
+        return self.steps[step].result()
 
+    def submit(self, step): # None when no thread can be started on this platform
+        try:
+            return self.pool and self.pool.submit(self.bake, step, self.sky1)
+        except RuntimeError:
+            self.pool = None
+
+    def baked(self, step): # baked right here, like RenderBands with one worker
+        future = Future()
+        future.set_result(self.bake(step, self.sky1))
+        return future
+
+class LevelLoader: # the next level built by a worker process while the current one is played, the frames keep the GIL
+    def __init__(self, level_textures, bundle=None):
+        self.level_textures, self.bundle, self.next = level_textures, bundle, None
+        try:
+            self.pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'))
+        except (OSError, NotImplementedError, ValueError): # no processes on this platform, levels are built when asked for
+            self.pool = None
+
+    def prepare(self, level, story): # starts building that level in the background
+        self.next = None
+        if self.pool is None:
+            return
+        bundle = self.bundle and self.bundle.path # the worker maps the bundle itself
+        try:
+            self.next = (level, story), asyncio.get_running_loop().run_in_executor(self.pool, build_level, level, story,
+                                                                                    self.level_textures, bundle)
+        except (OSError, RuntimeError): # the worker could not be started
+            self.pool = None
+
+    def ready(self, level, story):
+        return self.next is not None and self.next[0] == (level, story) and self.next[1].done()
+
+    async def get(self, level, story): # the prepared level if it is the one asked for, otherwise built now
+        if self.next is None or self.next[0] != (level, story):
+            self.prepare(level, story)
+        prepared, self.next, built = self.next, None, None
+        if prepared is not None:
+            try:
+                built = await prepared[1]
+            except BrokenExecutor: # the worker died, build them here from now on
+                self.pool = None
+        if built is None:
+            built = build_level(level, story, self.level_textures, self.bundle and self.bundle.path)
+        built_map, nlevel, textures, sheets, enemies, sightlines = built
+        sheets = [pg.image.frombuffer(pixels, pixels.shape[1::-1], 'RGBA') for pixels in sheets]
+        return built_map, nlevel, textures, sheets, enemies, sightlines
+
+def build_level(level, story, level_textures, bundle=None): # everything short of display surfaces, for LevelLoader
+    bundle = bundle and AssetBundle.open(bundle)
+    if story:
+        built_map = load_map(level)
+        nlevel = level_textures[level]
+    else:
+        size = np.random.randint(10+level*2, 16+level*2)
+        built_map = gen_map(size) + (size,)
+        nlevel = [np.random.randint(0,3), #sky1
+                  np.random.randint(0,4), #floorwall
+                  np.random.randint(0,3), #wall
+                  np.random.randint(0,2), #door
+                  np.random.randint(0,2), #window
+                  np.random.randint(0,5), #enemies
+                  ]
+    posx, posy, rot, rotv, maph, mapc, exitx, exity, stepscount, size = built_map
+    sheets = sprite_pixels('zombie_n_skeleton' + str(nlevel[5]), bundle), sprite_pixels('gun2', bundle)
+    enemies = spawn_enemies(level**2 + 10 + level, maph, size, posx, posy, level/2)
+    return built_map, nlevel, load_textures(nlevel, bundle), sheets, enemies, Sightlines(maph)
+
+class EnemyStore: # one typed array per enemy field, ids never move, the slots of the dead are reused by the next spawns
+    fields = {'x': np.float64, 'y': np.float64, # walls are checked in double, a rounded position could land inside one
+              'angle2p': np.float32, 'invdist': np.float32, 'type': np.int8, 'size': np.float32, 'direction': np.float32,
+              'dir2p': np.int8, 'health': np.float32, 'state': np.int8, 'cooldown': np.float64} # cooldown holds ticks
+
+    def __init__(self, capacity=64):
+        for name, dtype in self.fields.items():
+            setattr(self, name, np.zeros(capacity, dtype))
+        self.alive = np.zeros(capacity, bool)
+        self.free = list(range(capacity-1, -1, -1)) # lowest id first
+        self.order = np.zeros(0, int) # render order of the living in view, far to near
+
+    def __len__(self): # capacity, every column is this long
+        return len(self.alive)
+
+    @property
+    def ids(self):
+        return np.flatnonzero(self.alive)
+
+    def spawn(self, **values): # returns the new id, fields not given start at 0
+        if not self.free: # full, the only time the columns are copied
+            capacity = len(self)
+            for name in list(self.fields) + ['alive']:
+                column = getattr(self, name)
+                setattr(self, name, np.concatenate([column, np.zeros_like(column)]))
+            self.free = list(range(2*capacity-1, capacity-1, -1))
+        en = self.free.pop()
+        for name in self.fields:
+            getattr(self, name)[en] = values.get(name, 0)
+        self.invdist[en], self.alive[en] = values.get('invdist', 1), True
+        return en
+
+    def kill(self, en):
+        if self.alive[en]:
+            self.alive[en] = False
+            self.free.append(en)
+
+class EnemyGrid: # live enemies bucketed by map cell, moved between buckets only when they cross a cell border
+    def __init__(self, enemies, size):
+        self.size = size
+        self.counts = np.zeros((size, size), int) # enemies per cell
+        self.near = np.zeros((size, size)) # enemies in the 3x3 block around each cell, the mape heatmap
+        self.buckets = {} # flat cell: enemy indices
+        self.cells = np.full(len(enemies), -1) # flat cell of every enemy id, -1 for the dead and free slots
+        self.update(enemies)
+
+    def update(self, enemies): # after moves, teleports and deaths
+        cells = np.where(enemies.alive, enemies.x.astype(int)*self.size + enemies.y.astype(int), -1)
+        self.cells = np.pad(self.cells, (0, len(cells) - len(self.cells)), constant_values=-1) # the store may have grown
+        moved = np.flatnonzero(cells != self.cells)
+        for en, old, new in zip(moved, self.cells[moved], cells[moved]):
+            if old >= 0:
+                self.buckets[old].discard(en)
+            if new >= 0:
+                self.buckets.setdefault(new, set()).add(en)
+        self.count(self.cells[moved], -1)
+        self.count(cells[moved], 1)
+        self.cells = cells
+
+    def count(self, cells, sign):
+        x, y = np.divmod(cells[cells >= 0], self.size)
+        np.add.at(self.counts, (x, y), sign)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                inside = (x+dx >= 0) & (x+dx < self.size) & (y+dy >= 0) & (y+dy < self.size)
+                np.add.at(self.near, (x[inside]+dx, y[inside]+dy), sign)
+
+    def radius(self, enemies, x, y, reach): # indices of the enemies within reach, only occupied cells are visited
+        x0, y0 = max(0, int(x-reach)), max(0, int(y-reach))
+        cells = np.argwhere(self.counts[x0:int(x+reach)+1, y0:int(y+reach)+1] > 0) + (x0, y0)
+        found = np.asarray([en for cell in cells[:, 0]*self.size + cells[:, 1] for en in self.buckets[cell]], int)
+        return found[(enemies.x[found]-x)**2 + (enemies.y[found]-y)**2 <= reach**2]
+
+    def cone(self, enemies, x, y, angle, spread, reach, slack=0): # within reach and spread of angle, give or take slack
+        found = self.radius(enemies, x, y, reach)
+        dist = np.sqrt((enemies.x[found]-x)**2 + (enemies.y[found]-y)**2 + 1e-16)
+        off = (np.arctan2(enemies.y[found]-y, enemies.x[found]-x) - angle + np.pi)%(2*np.pi) - np.pi
+        return found[np.abs(off) <= spread + np.arcsin(np.minimum(1, slack/dist))]
+
+class AIScheduler: # who thinks this tick: the near every tick, the busy in turns, the far and idle seldom, up to a cap
+    tiers = ['near', 'mid', 'far']
+
+    def __init__(self, near=6, far=12, cap=256):
+        self.near, self.far, self.cap = near, far, cap # near is as far as enemies look for the player
+        self.tick, self.capped = 0, 0
+        self.updates, self.population = np.zeros(3), np.zeros(3) # smoothed per tick
+
+    def pick(self, enemies, posx, posy, rate=0.1): # rate is how often the mid tier updates, the far one four times less
+        self.tick += 1
+        en = enemies.ids
+        dist = np.sqrt((enemies.x[en]-posx)**2 + (enemies.y[en]-posy)**2)
+        tier = np.where(dist < self.near, 0, np.where((dist < self.far) & (enemies.state[en] != 0), 1, 2))
+        period = np.asarray([1, max(1, round(1/rate)), max(1, round(4/rate))])[tier]
+        due = (en + self.tick)%period == 0 # round robin, spread over the ticks by id
+        self.population += 0.1*(np.bincount(tier, minlength=3) - self.population)
+        en, tier, dist = en[due], tier[due], dist[due]
+        if len(en) > self.cap: # nearest tiers first, then nearest enemies
+            keep = np.lexsort((dist, tier))[:self.cap]
+            self.capped += len(en) - self.cap
+            en, tier = en[keep], tier[keep]
+        self.updates += 0.1*(np.bincount(tier, minlength=3) - self.updates)
+        return en
+
+    def readout(self): # updates / enemies per tick in each tier
+        tiers = [name+' '+str(round(self.updates[i], 1))+'/'+str(round(self.population[i])) for i, name in enumerate(self.tiers)]
+        return ['ai '+' '.join(tiers), 'ai capped '+str(self.capped)]
+
+class FlowField: # steps to the player's cell from every cell, redone only when the player enters another cell
+    def __init__(self, maph):
+        self.free, self.cell = maph == 0, None
+        self.dist = np.full(maph.shape, -1)
+        self.nextx, self.nexty = np.indices(maph.shape)
+
+    def update(self, posx, posy):
+        if (int(posx), int(posy)) == self.cell:
+            return
+        self.cell = int(posx), int(posy)
+        size = self.free.shape
+        self.dist = grid_distances(self.free, self.cell)
+
+        far = np.where(self.dist < 0, 2**30, self.dist) # downhill neighbour, diagonals only past two free sides
+        far = np.pad(far, 1, constant_values=2**30)
+        best = far[1:-1, 1:-1].copy()
+        self.nextx, self.nexty = np.indices(size)
+        for i, j in ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)):
+            step = far[1+i:1+i+size[0], 1+j:1+j+size[1]].copy()
+            if i and j:
+                step[(far[1+i:1+i+size[0], 1:-1] >= 2**30) | (far[1:-1, 1+j:1+j+size[1]] >= 2**30)] = 2**30
+            better = step < best
+            best[better] = step[better]
+            self.nextx[better] += i
+            self.nexty[better] += j
+
+    def heading(self, x, y): # angle to walk from each position, and where that beats heading straight for the player
+        cells = x.astype(int), y.astype(int)
+        return kernels.angles2p(x, y, self.nextx[cells] + 0.5, self.nexty[cells] + 0.5), self.dist[cells] > 1
+
+def grid_distances(free, cell): # steps from cell to every free cell, -1 where it can not be reached
+    size = free.shape
+    dist = np.full(size, -1)
+    dist[cell] = 0
+    front, steps = np.ravel_multi_index(cell, size)[None], 0
+    while len(front): # breadth first, one ring of cells at a time
+        steps += 1
+        x, y = np.unravel_index(front, size)
+        x, y = np.concatenate([x-1, x+1, x, x]), np.concatenate([y, y, y-1, y+1])
+        inside = (x >= 0) & (x < size[0]) & (y >= 0) & (y < size[1])
+        x, y = x[inside], y[inside]
+        new = free[x, y] & (dist[x, y] < 0)
+        front = np.unique(np.ravel_multi_index((x[new], y[new]), size))
+        dist.flat[front] = steps
+    return dist
+
+class Sightlines: # potentially visible set, per sub cell and offset within reach: surely clear, surely blocked or unsure
+    reach = 6 # enemies only look for the player closer than this
+    margin = 0.2 # walkers keep this far from a wall beside them (check_walls), the clear bits count on it
+
+    def __init__(self, maph, sub=2):
+        self.maph, self.size, self.sub = maph, len(maph), sub
+        reach, m, n = self.reach*sub, (self.reach + 2)*sub, self.size*sub
+        wrapped = maph[np.arange(self.size)%(self.size-1)][:, np.arange(self.size)%(self.size-1)] # what vision() reads
+        free = np.kron((maph == 0) & (wrapped == 0), np.ones((sub, sub), bool))
+        walls = np.kron((maph != 0) & (wrapped != 0), np.ones((sub, sub), bool))
+        free, walls = np.pad(free, m), np.pad(walls, m) # outside the map is neither
+
+        def shifted(grid, i, j): # grid value of the sub cell at offset i, j from every sub cell
+            return grid[m+i:m+i+n, m+j:m+j+n]
+
+        # one bit per side with a wall next to it (-x, +x, -y, +y), walkers stand away from those sides of the sub cell
+        self.sides = sum(~shifted(free, i, j) << np.uint8(bit) for bit, (i, j) in enumerate(((-1, 0), (1, 0), (0, -1), (0, 1))))
+        self.sides[~shifted(free, 0, 0)] = 0 # never clear anyway
+        kinds = tuple(np.unique(self.sides).tolist()) # at most 9 of the 16 with sub > 1, one side along each axis
+        kind = np.pad(np.searchsorted(kinds, self.sides), m)
+
+        def covered(grid, i, j, touched, pairs): # grid is True on every sub cell at i, j that touched has for the pair
+            every = np.ones((n, n), bool)
+            for i, j, touched in zip(i, j, touched):
+                every &= shifted(grid, i, j) if touched.all() else shifted(grid, i, j) | ~touched[pairs]
+            return every
+
+        clear = np.zeros((n, n, (2*reach + 1)**2), bool)
+        blocked = np.zeros((n, n, (2*reach + 1)**2), bool)
+        for k in range((2*reach + 1)**2):
+            dx, dy = k//(2*reach + 1) - reach, k%(2*reach + 1) - reach
+            pairs = shifted(kind, 0, 0)*len(kinds) + shifted(kind, dx, dy) # where both walkers may stand
+            clear[..., k] = covered(free, *sightline_hull(dx, dy, kinds, sub, self.margin), pairs)
+            i, j, touched = sightline_hull(dx, dy, kinds, sub, self.margin, pad=-1e-6) # the lines, where they cross a band
+            for axis, line in sightline_bands(dx, dy, sub):
+                band = (i, j)[axis] == line
+                blocked[..., k] |= covered(walls, i[band], j[band], touched[band], pairs)
+        self.clear, self.blocked = np.packbits(clear, 2), np.packbits(blocked, 2) # 2 bits per pair
+
+    def visible(self, posx, posy, enx, eny, dist2p): # same answers as kernels.visions, marching only the unsure ones
+        reach = self.reach*self.sub
+        x, y = (enx*self.sub).astype(int), (eny*self.sub).astype(int)
+        dx, dy = int(posx*self.sub) - x, int(posy*self.sub) - y
+        near = (np.abs(dx) <= reach) & (np.abs(dy) <= reach) & (dist2p >= 0.5) # closer, vision() samples past the player
+        k = np.where(near, (dx + reach)*(2*reach + 1) + dy + reach, 0)
+        bit = np.uint8(7) - (k & 7).astype(np.uint8)
+        standing = self.standing(enx*self.sub, eny*self.sub) & self.standing(np.float64(posx)*self.sub, np.float64(posy)*self.sub)
+        seen = near & standing & ((self.clear[x, y, k >> 3] >> bit) & 1 == 1)
+        unsure = ~seen & ~(near & standing & ((self.blocked[x, y, k >> 3] >> bit) & 1 == 1))
+        seen[unsure] = kernels.visions(posx, posy, enx[unsure], eny[unsure], dist2p[unsure], self.maph, self.size)
+        return seen
+
+    def standing(self, x, y): # in sub cell units, False for walkers closer to a wall than the clear bits assume
+        sides, x, y, margin = self.sides[x.astype(int), y.astype(int)], x%1, y%1, self.margin*self.sub
+        return ((x >= margin*(sides & 1)) & (x <= 1 - margin*(sides >> 1 & 1)) &
+                (y >= margin*(sides >> 2 & 1)) & (y <= 1 - margin*(sides >> 3 & 1)))
+
+@functools.lru_cache(maxsize=None)
+def sightline_hull(dx, dy, kinds=tuple(range(16)), sub=1, margin=0.2, pad=0.02, skip=(0.3, 0.25)):
+    # in sub cell units: sub cells vision() may probe between walkers standing in the sub cell at (0, 0) and the one at
+    # (dx, dy), for each pair of sides out of kinds (source*len(kinds) + target). Where they stand is the sub cell shrunk by
+    # the margin on those sides, and the samples are the sightlines without skip at both ends, so in the hull of both
+    # rectangles and of both moved in by skip along every direction between them (every (1-t)*first + t*second)
+    sides = np.asarray(kinds)
+    shrunk = np.stack([margin*sub*(sides & 1), 1 - margin*sub*(sides >> 1 & 1),
+                       margin*sub*(sides >> 2 & 1), 1 - margin*sub*(sides >> 3 & 1)])
+    a, b = np.repeat(shrunk, len(kinds), 1), np.tile(shrunk, len(kinds)) + np.c_[[dx, dx, dy, dy]]
+    i, j = np.meshgrid(np.arange(min(0, dx) - 1, max(0, dx) + 2), np.arange(min(0, dy) - 1, max(0, dy) + 2), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+
+    def overlaps(a, b): # per cell and pair, for rectangles x0, x1, y0, y1 grown by the probe
+        a, b = a + np.c_[[-pad, pad, -pad, pad]]*sub, b + np.c_[[-pad, pad, -pad, pad]]*sub
+        c = np.stack([i[:, None] + 1 - a[0], a[1] - i[:, None], j[:, None] + 1 - a[2], a[3] - j[:, None]])
+        d = np.stack([a[0] - b[0], b[1] - a[1], a[2] - b[2], b[3] - a[3]])[:, None] # overlaps at t if all c + t*d >= 0
+        t = -c/np.where(d == 0, 1, d)
+        first, last = np.where(d > 0, t, 0).max(0), np.where(d < 0, t, 1).min(0)
+        return (first <= last) & ((d != 0) | (c >= 0)).all(0)
+
+    span = np.stack([b[0] - a[1], b[1] - a[0], b[2] - a[3], b[3] - a[2]]) # of source to target offsets
+    def bounds(along, across): # of along/length over the span, at its ends, with across at its ends or 0 if inside
+        along, across = np.repeat(along, 3, 0), np.tile(np.stack([*across, np.clip(0, *across)]), (2, 1))
+        cos = along/np.maximum(np.hypot(along, across), 1e-9)
+        return cos.min(0), cos.max(0)
+    anywhere = (span[0] <= 0) & (span[1] >= 0) & (span[2] <= 0) & (span[3] >= 0) # overlapping, any direction
+    cos = np.where(anywhere, [[-1], [1]], bounds(span[:2], span[2:]))
+    sin = np.where(anywhere, [[-1], [1]], bounds(span[2:], span[:2]))
+    moved = np.stack([cos[0], cos[1], sin[0], sin[1]])*sub
+    touched = overlaps(a, b) & overlaps(a + skip[0]*moved, b - skip[1]*moved[[1, 0, 3, 2]])
+    return i[touched.any(1)], j[touched.any(1)], touched[touched.any(1)]
+
+@functools.lru_cache(maxsize=None)
+def sightline_bands(dx, dy, sub=1, skip=0.3, step=0.05):
+    # in sub cell units: the rows (axis 0) or columns (axis 1) between (0, 0) and (dx, dy) that every sightline crosses
+    # inside the stretch vision() samples (skip from both ends, every step), blocked where they are all wall
+    skip, step = skip*sub, step*sub
+    return [(axis, line) for axis, d in ((1, dy), (0, dx)) for line in range(min(0, d) + 1, max(0, d))
+            if 1 - max(0, skip - abs(line) + 1) - max(0, skip - abs(d - line) + 1) >= step] # else might cross unlooked
+
+def blit_occluded(surf, spsurf, pos, dist, depth): # blit only the sprite columns in front of the walls
+    x0 = int(pos[0])
+    cols = np.arange(max(0, x0), min(len(depth), x0 + spsurf.get_width()))
+    if len(cols) == 0:
+        return
+    visible = np.zeros(len(cols)+2, bool)
+    visible[1:-1] = dist < depth[cols]
+    edges = np.flatnonzero(np.diff(visible)) # visible runs start and end in pairs
+    for start, end in zip(edges[::2], edges[1::2]):
+        surf.blit(spsurf, (cols[start], pos[1]), (cols[start]-x0, 0, end-start, spsurf.get_height()))
+
+def load_sounds(bundle=None): # nothing is decoded here, effects on their first play and music is streamed
+    files = {'step': 'playerstep', 'step2': 'enemystep', 'swoosh': 'gun', 'swoosh2': 'gun2', 'hurt': 'damage',
+             'deadmonster': 'deadmonster', 'hitmonster': 'hitmonster', 'hitmonster2': 'hitmonster2', 'healthup': 'healthup',
+             'died': 'died', 'won': 'won'}
+    cache = SoundCache(bundle)
+
+    sounds = {key: LazySound(name, cache) for key, name in files.items()}
+    sounds['music0'], sounds['music1'] = Music('battlemusic0'), Music('battlemusic1')
     return sounds
 
+def load_sound(name, bundle=None):
+    if bundle is not None and 'Sounds/'+name in bundle and bundle.mixer == list(pg.mixer.get_init()): # samples fit one mixer
+        return pg.mixer.Sound(buffer=bundle['Sounds/'+name])
+    return pg.mixer.Sound('Assets/Sounds/'+name+'.ogg')
+
+class SoundCache: # decoded samples per sound file, least recently played dropped first once over the cap
+    def __init__(self, bundle=None, max_bytes=8*2**20):
+        self.sounds, self.nbytes, self.max_bytes, self.bundle = OrderedDict(), 0, max_bytes, bundle
+
+    def __contains__(self, name):
+        return name in self.sounds
+
+    def get(self, name):
+        if name in self.sounds:
+            self.sounds.move_to_end(name)
+            return self.sounds[name]
+
+        sound = load_sound(name, self.bundle)
+        self.sounds[name] = sound
+        self.nbytes += self.size(sound)
+        while self.nbytes > self.max_bytes and len(self.sounds) > 1: # the mixer keeps those still playing alive
+            self.nbytes -= self.size(self.sounds.popitem(last=False)[1])
+        return sound
+
+    @staticmethod
+    def size(sound):
+        freq, size, channels = pg.mixer.get_init()
+        return int(sound.get_length()*freq)*channels*(abs(size)//8)
+
+class LazySound: # stands in for a pygame Sound, decoded on the first play and keeping its volume until then
+    def __init__(self, name, cache):
+        self.name, self.cache, self.volume = name, cache, 1.0
+
+    def set_volume(self, volume):
+        self.volume = volume
+        if self.name in self.cache: # also the copies playing now, like a Sound
+            self.cache.get(self.name).set_volume(volume)
+
+    def play(self, loops=0):
+        sound = self.cache.get(self.name)
+        sound.set_volume(self.volume)
+        return sound.play(loops)
+
+class Music: # a track streamed from its file by pygame.mixer.music, one at a time and never decoded whole
+    def __init__(self, name):
+        self.path, self.volume = 'Assets/Sounds/'+name+'.ogg', 1.0
+
+    def set_volume(self, volume):
+        self.volume = volume
+        pg.mixer.music.set_volume(volume) # the tracks share the one volume anyway
+
+    def play(self, loops=0):
+        pg.mixer.music.set_volume(self.volume)
+        if pg.mixer.music.get_busy(): # still fading out, starts when the other track is gone
+            pg.mixer.music.queue(self.path, loops=loops)
+        else:
+            pg.mixer.music.load(self.path)
+            pg.mixer.music.play(loops)
+
+    def fadeout(self, time):
+        pg.mixer.music.fadeout(time)
+
 def pause_menu(surf, menu, pause, options, click, running, m_vol, sfx_vol, sounds, newgame, font, msg, level, ticks, hres, story):
     adjust_res = 1
     p_mouse = pg.mouse.get_pos()
@@ -819,20 +1340,25 @@ def pause_menu(surf, menu, pause, options, click, running, m_vol, sfx_vol, sound
     return surf, pause, options, running, newgame, adjust_res, m_vol, sfx_vol, story
 
 def adjust_resolution(hres=210):
-    hres = (hres//4)*4
-    hres = max(min(hres, 800), 80) # limit range from 80x60 to 800x600
+    hres = resolution_step(hres)
     halfvres = int(hres*0.375/4)*4 #vertical resolution/2
     mod = hres/60 #scaling factor (60° fov)
-    frame = np.random.randint(0,255, (hres, halfvres*2, 3))
-    frame_half = np.random.randint(0,255, (hres//2, halfvres*2//2, 3))
+    frame = np.zeros((hres, halfvres*2, 3), np.uint8) # every pixel is drawn over each frame
+    frame_half = np.zeros((hres//2, halfvres*2//2, 3), np.uint8)
 
     return hres, halfvres, mod, frame, frame_half
 
+def resolution_step(hres):
+    return max(min((hres//4)*4, 800), 80) # limit range from 80x60 to 800x600
+
+def nearby_resolutions(user_hres, governor): # what the options menu or the governor may switch to next
+    res, step = governor.ladders['res'], governor.level['res']
+    menu = [resolution_step(int(user_hres*zoom))*governor['res'] for zoom in (0.9, 1.1)]
+    return [int(hres) for hres in menu] + [int(user_hres*res[i]) for i in (step-1, step+1) if 0 <= i < len(res)]
+
 def set_volume(m_vol, sfx_vol, sounds):
     for key in sounds.keys():
-        sounds[key].set_volume(sfx_vol)
-    sounds['music0'].set_volume(m_vol)
-    sounds['music1'].set_volume(m_vol)
+        sounds[key].set_volume(m_vol if key.startswith('music') else sfx_vol)
 
 async def splash_screen(msg, splash, clock, font, screen):
     running = 1
@@ -860,46 +1386,214 @@ async def splash_screen(msg, splash, clock, font, screen):
             msg = "Press any key..."
         await asyncio.sleep(0)
 
-def load_textures(textures):
-    sky1 = pg.image.load('Assets/Textures/skybox'+str(textures[0])+'.jpg').convert()
-    sky = pg.surface.Surface((sky1.get_size()[0]*2, sky1.get_size()[1]))
-    sky.blit(sky1, (0,0))
-    sky.blit(sky1, (sky1.get_size()[0],0))
-    floor = pg.image.load('Assets/Textures/floor'+str(textures[1])+'.jpg').convert()
-    wall = pg.image.load('Assets/Textures/wall'+str(textures[2])+'.jpg').convert()
-    bwall = pg.transform.smoothscale(pg.image.load('Assets/Textures/wall'+str(textures[2])+'.jpg'), (25,25)).convert()
-    bwall = pg.transform.smoothscale(bwall, (100,100)).convert()
-    door = pg.image.load('Assets/Textures/door'+str(textures[3])+'.jpg').convert()
-    window = pg.image.load('Assets/Textures/window'+str(textures[4])+'.jpg').convert()
-    size = wall.get_size()
-    if textures[0]%3 > 0: # darker at night
-        tint = pygame.Surface(size)
-        tint.fill('#000000')
-        tint.set_alpha(150)
-        floor.blit(tint,(0,0))
-        wall.blit(tint,(0,0))
-        bwall.blit(tint,(0,0))
-        door.blit(tint,(0,0))
-        window.blit(tint,(0,0))
-
-    full_wall = pygame.Surface((size[0]*3, size[1]*3))
-    for i in range(3):
-        for j in range(3):
-            full_wall.blit(wall, (size[0]*i,size[1]*j))
-    full_window = full_wall.copy()
-    full_window.blit(window, size)
-    full_door = full_wall.copy()
-    full_door.blit(door, size)
-    full_door.blit(door, (size[0],size[1]*2))
-    textures_list = [full_wall, full_door, full_window]
-    floor = pg.surfarray.array3d(floor)
+def load_textures(textures, bundle=None): # arrays only, the sky becomes a surface on the main thread
+    night = textures[0]%3 > 0 # darker at night
+    sky = texture_array('skybox'+str(textures[0]), bundle=bundle)
+    sky = np.concatenate([sky, sky]) # twice around
+    floor = texture_array('floor'+str(textures[1]), night, bundle)
+    wall = texture_array('wall'+str(textures[2]), night, bundle)
+    door = texture_array('door'+str(textures[3]), night, bundle)
+    window = texture_array('window'+str(textures[4]), night, bundle)
+    size = wall.shape[:2]
+
+    full_wall = np.tile(wall, (3, 3, 1))
+    full_window = paste(full_wall.copy(), window, size)
+    full_door = paste(paste(full_wall.copy(), door, size), door, (size[0], size[1]*2))
+    textures_list = mip_chain(np.asarray([full_wall, full_door, full_window]))
+    floor = mip_chain(floor)
 
     return sky, floor, textures_list
 
+def texture_array(name, night=False, bundle=None): # pixels of a texture as surfarray lays them out
+    key = 'Textures/' + name + ' night'*night
+    if bundle is not None and key in bundle:
+        return bundle[key].copy() # small, and the kernels want them writable
+    texture = pg.surfarray.array3d(pg.image.load('Assets/Textures/'+name+'.jpg'))
+    if night: # same as blitting black at alpha 150
+        texture = texture - ((texture.astype(np.uint16)*150 + 255) >> 8).astype(np.uint8)
+    return texture
+
+def paste(target, pixels, pos): # like a blit, clipped to the target
+    x, y = pos
+    w, h = min(len(pixels), len(target) - x), min(len(pixels[0]), len(target[0]) - y)
+    target[x:x+w, y:y+h] = pixels[:w, :h]
+    return target
+
+def mip_chain(texture): # halved with a 2x2 box filter down to a single texel
+    mips = [texture]
+    while min(mips[-1].shape[-3:-1]) > 1:
+        last = mips[-1][..., :mips[-1].shape[-3]//2*2, :mips[-1].shape[-2]//2*2, :].astype(np.uint16)
+        mips.append(((last[..., ::2, ::2, :] + last[..., 1::2, ::2, :] + last[..., ::2, 1::2, :] + last[..., 1::2, 1::2, :] + 2)//4).astype(np.uint8))
+    return mips
+
+def random_policy(posx, posy, rot, rotv, enemies, route): # mashes keys and swings at random
+    keys = defaultdict(bool, {key: np.random.uniform() < 0.3 for key in (pg.K_UP, pg.K_DOWN, pg.K_LEFT, pg.K_RIGHT)})
+    return keys, np.random.randint(-30, 31, 2), np.random.uniform() < 0.05
+
+def hunter_policy(posx, posy, rot, rotv, enemies, route): # faces and hits whatever comes close, otherwise follows the route
+    alive = enemies.ids
+    dist = np.sqrt((enemies.x[alive]-posx)**2 + (enemies.y[alive]-posy)**2)
+    heading, far = route.heading(np.asarray([posx]), np.asarray([posy]))
+    target, pitch, close = heading[0], 0, False
+    if len(alive) and (dist.min() < 1 or dist.min() < 3 and not far[0]): # no wall in between
+        near, dist = alive[dist.argmin()], dist.min()
+        target, close = kernels.angle2p(posx, posy, enemies.x[near], enemies.y[near]), dist < 1
+        pitch = -math.asin(np.clip((0.06*enemies.size[near] - 0.5)/(dist+0.2), -1, 1))/0.392699 # aim at the chest
+    turn = (target - rot + np.pi)%(2*np.pi) - np.pi
+    look = np.clip([turn*600, (pitch - rotv)*600], -300, 300).astype(int)
+    return defaultdict(bool, {pg.K_UP: not close}), look, close
+
+def headless(steps=3600, size=None, nenemies=None, story=0, policy=hunter_policy, sim_rate=60, report=600):
+    # the game without display or audio, for soak runs and benchmarks: fixed steps as fast as they go
+    step = 2/sim_rate
+    level, player_health, swordsp, ticks = 0, 20, 0, 0
+    cleared = deaths = kills = 0
+    newgame, start, busy = 1, time.perf_counter(), 0
+    for n in range(steps):
+        if newgame:
+            if story:
+                posx, posy, rot, rotv, maph, mapc, exitx, exity, stepscount, msize = load_map(level)
+            else:
+                msize = size or np.random.randint(10+level*2, 16+level*2)
+                posx, posy, rot, rotv, maph, mapc, exitx, exity, stepscount = gen_map(msize)
+            count = nenemies or level**2 + 10 + level
+            enemies = spawn_enemies(count, maph, msize, posx, posy, level/2)
+            sightlines = Sightlines(maph) if msize <= 128 else None # the set grows with the square of the map, plain vision past that
+            flow, route, grid = FlowField(maph), FlowField(maph), EnemyGrid(enemies, msize) # route leads the policy around
+            scheduler = AIScheduler()
+            left, exit2, newgame = count, 1, 0
+            print('level', level, 'map', msize, 'enemies', count)
+            tick = time.perf_counter()
+
+        ticks = ticks + step*2.5 # pg ticks are counted in 200 ms
+        enemies, player_health, mape = enemies_ai(posx, posy, enemies, maph, msize, grid, swordsp, ticks, player_health, left,
+                                                  level/3, 0.1, sightlines, scheduler)
+        flow.update(posx, posy)
+        move_enemies(enemies, maph, step/3, flow)
+        if exit2: # to the nearest enemy while any is left, then to the exit
+            alive = enemies.ids
+            near = alive[np.argmin((enemies.x[alive]-posx)**2 + (enemies.y[alive]-posy)**2)]
+            route.update(enemies.x[near], enemies.y[near])
+        else:
+            route.update(exitx+0.5, exity+0.5)
+        keys, look, swing = policy(posx, posy, rot, rotv, enemies, route)
+        posx, posy, rot, rotv = movement(keys, look, posx, posy, rot, maph, step, rotv)
+
+        if swing and swordsp < 1:
+            swordsp = 1
+        if swordsp == 1:
+            camx, camy = posx-0.2*np.cos(rot), posy-0.2*np.sin(rot)
+            reach = kernels.lodev_DDA(posx, posy, rot, maph)[4] + 0.2
+            order = sort_sprites(camx, camy, rot, enemies)
+            targets = grid.cone(enemies, camx, camy, rot, 0.05, reach, 0.1)
+            targets = order[::-1][np.isin(order[::-1], targets) & (enemies.invdist[order[::-1]] <= 10)]
+            for en in sword_hits(enemies, targets, camx, camy, rot, rotv, reach, ticks, maph):
+                if not enemies.alive[en]:
+                    kills, left = kills + 1, left - 1
+                    if left == 0:
+                        exit2 = 0
+        if int(swordsp) > 0:
+            swordsp = (swordsp + step*10)%4
+
+        if player_health <= 0 or (exit2 == 0 and int(posx) == exitx and int(posy) == exity):
+            if player_health <= 0:
+                level, player_health, deaths = 0, 20, deaths + 1
+            else:
+                level, player_health, cleared = (level+1)%6, min(player_health+2, 20), cleared + 1
+            busy, newgame = busy + time.perf_counter() - tick, 1
+
+        if report and (n+1)%report == 0:
+            print('step', n+1, 'health', round(player_health, 1), 'enemies left', left, *scheduler.readout())
+
+    busy = busy + time.perf_counter() - tick
+    results = {'steps': steps, 'seconds': time.perf_counter() - start, 'ticks/s': steps/max(busy, 1e-9),
+               'cleared': cleared, 'deaths': deaths, 'kills': kills}
+    print('steps', steps, 'in %.1f s' % results['seconds'], '%.0f ticks/s' % results['ticks/s'], '(without level loads),',
+          'cleared', cleared, 'deaths', deaths, 'kills', kills)
+    return results
+
+class AssetBundle: # textures, tinted variants, sprite sheets and decoded sound effects in one file, mapped rather than decoded
+    path = 'Assets/__pycache__/assets.bundle' # python dead_end_game.py --bundle
+    version = 2
+
+    def __init__(self, data, arrays, mixer, path):
+        self.data, self.arrays, self.mixer, self.path = data, arrays, mixer, path
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name): # read only view of the mapped file
+        offset, shape, dtype = self.arrays[name]
+        return np.frombuffer(self.data, dtype, int(np.prod(shape)), offset).reshape(shape)
+
+    @staticmethod
+    def stamp(path):
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    @classmethod
+    def open(cls, path=None): # None when missing or any source changed since the build
+        path = path or cls.path
+        try:
+            with open(path, 'rb') as file:
+                length = int.from_bytes(file.read(8), 'little')
+                header = json.loads(file.read(length))
+            if header['version'] != cls.version or any(cls.stamp(source) != stamp for source, stamp in header['sources'].items()):
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        data = np.memmap(path, np.uint8, 'r', offset=-(-(8+length)//64)*64)
+        return cls(data, header['arrays'], header['mixer'], path)
+
+    @classmethod
+    def build(cls, path=None):
+        path = path or cls.path
+        if not pg.mixer.get_init():
+            pg.mixer.init()
+        arrays, sources = {}, []
+        for name in sorted(os.listdir('Assets/Textures')): # named after the path in Assets, without the extension
+            if name.startswith(('skybox', 'floor', 'wall', 'door', 'window')) and name[:-4][-1].isdigit():
+                arrays['Textures/'+name[:-4]] = texture_array(name[:-4])
+                if not name.startswith('skybox'):
+                    arrays['Textures/'+name[:-4]+' night'] = texture_array(name[:-4], True)
+                sources.append('Assets/Textures/'+name)
+        for name in sorted(os.listdir('Assets/Sprites')):
+            arrays['Sprites/'+name[:-4]] = sprite_pixels(name[:-4])
+            sources.append('Assets/Sprites/'+name)
+        for name in sorted(os.listdir('Assets/Sounds')):
+            if name.endswith('.ogg') and not name.startswith('battlemusic'): # music is streamed from the ogg
+                arrays['Sounds/'+name[:-4]] = pg.sndarray.array(pg.mixer.Sound('Assets/Sounds/'+name))
+                sources.append('Assets/Sounds/'+name)
+
+        index, offset = {}, 0
+        for name, array in arrays.items():
+            offset = -(-offset//64)*64 # aligned
+            index[name] = [offset, list(array.shape), array.dtype.str]
+            offset += array.nbytes
+        header = json.dumps({'version': cls.version, 'sources': {source: cls.stamp(source) for source in sources},
+                             'mixer': list(pg.mixer.get_init()), 'arrays': index}).encode()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as file:
+            file.write(len(header).to_bytes(8, 'little') + header)
+            start = -(-(8+len(header))//64)*64
+            for name, array in arrays.items():
+                file.seek(start + index[name][0])
+                file.write(np.ascontiguousarray(array).tobytes())
+        os.replace(path + '.tmp', path) # never half written
+        print('bundled', len(arrays), 'assets,', round((start+offset)/2**20, 1), 'MB in', path)
+
 
 if __name__ == '__main__':
-    pg.mixer.init()
-    asyncio.run(main())
-    pg.mixer.fadeout(1000)
-    pg.time.wait(1000)
-    pg.quit()
\ No newline at end of file
+    if '--bundle' in sys.argv:
+        AssetBundle.build()
+    elif '--headless' in sys.argv: # --headless [steps] [map size] [enemies] [random], no window nor sound
+        args = sys.argv[sys.argv.index('--headless')+1:]
+        numbers = [int(arg) for arg in args if arg.isdigit()]
+        headless(*numbers[:3], policy=random_policy if 'random' in args else hunter_policy, story='story' in args)
+    else:
+        pg.mixer.init()
+        asyncio.run(main())
+        pg.mixer.fadeout(1000)
+        pg.mixer.music.fadeout(1000)
+        pg.time.wait(1000)
+        pg.quit()
\ No newline at end of file
@@ -0,0 +1,275 @@
+# Hot loops of dead_end_game: a plain NumPy backend and, when numba is installed, a compiled one.
+# Compiled kernels are cached on disk (__pycache__) so the JIT cost is only paid on the first launch.
+# Compiled kernels release the GIL, so the column bands of a frame can be drawn by several threads at once.
+# Pick one with use('numba'), use('numpy') or use('auto'), or the DEAD_END_KERNELS environment variable.
+import os
+import math
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError: # numpy backend only
+    njit = None
+
+
+def lodev_DDA(x, y, rot_i, mapa):
+    return dda_ray(x, y, math.sin(rot_i), math.cos(rot_i), mapa)[:6]
+
+def dda_ray(x, y, sin, cos, mapa):
+    sizeX = len(mapa) - 1
+    sizeY = len(mapa[0]) - 1
+    norm = math.sqrt(cos**2 + sin**2)
+    rayDirX, rayDirY = cos/norm + 1e-16, sin/norm + 1e-16
+    x1, y1, x2, y2, dist_near, dist_far = 0.0, 0.0, 0.0, 0.0, 999.0, 999.0
+    side, side_near, side_far = 0, 0, 0
+
+    mapX, mapY = int(x), int(y)
+
+    deltaDistX, deltaDistY = abs(1/rayDirX), abs(1/rayDirY)
+
+    if rayDirX < 0:
+        stepX, sideDistX = -1, (x - mapX) * deltaDistX
+    else:
+        stepX, sideDistX = 1, (mapX + 1.0 - x) * deltaDistX
+
+    if rayDirY < 0:
+        stepY, sideDistY = -1, (y - mapY) * deltaDistY
+    else:
+        stepY, sideDistY = 1, (mapY + 1.0 - y) * deltaDistY
+
+    for i in range(30):
+        if (sideDistX < sideDistY):
+            sideDistX += deltaDistX
+            mapX += stepX
+            dist = sideDistX
+            side = 0
+            if mapX < 0 or mapX > sizeX:
+                return x1, y1, x2, y2, dist_near, dist_far, side_near, side_far
+        else:
+            sideDistY += deltaDistY
+            mapY += stepY
+            dist = sideDistY
+            side = 1
+            if mapY < 0 or mapY > sizeY:
+                return x1, y1, x2, y2, dist_near, dist_far, side_near, side_far
+        if (mapa[mapX][mapY] > 0 and dist_near == 999) or mapa[mapX][mapY] > 2:
+            if side:
+                dist2 = dist - deltaDistY + 0.0001
+            else:
+                dist2 = dist - deltaDistX + 0.0001
+            if dist_near == 999:
+                dist_near, side_near = dist2, side
+                x1 = (x + rayDirX*dist_near)%sizeX
+                y1 = (y + rayDirY*dist_near)%sizeY
+            if mapa[mapX][mapY] > 2:
+                dist_far, side_far = dist2, side
+                x2 = (x + rayDirX*dist_far)%sizeX
+                y2 = (y + rayDirY*dist_far)%sizeY
+                break
+
+    return x1, y1, x2, y2, dist_near, dist_far, side_near, side_far
+
+def lodev_DDA_rays(x, y, rots, mapa): # lodev_DDA for a whole array of rays, stepped in lockstep
+    sizeX = len(mapa) - 1
+    sizeY = len(mapa[0]) - 1
+    sin, cos = np.sin(rots), np.cos(rots)
+    norm = np.sqrt(cos**2 + sin**2)
+    rayDirX, rayDirY = cos/norm + 1e-16, sin/norm + 1e-16
+    dist_near, dist_far = np.full(len(rots), 999.0), np.full(len(rots), 999.0)
+    side_near, side_far = np.zeros(len(rots), int), np.zeros(len(rots), int)
+
+    mapX, mapY = np.full(len(rots), int(x)), np.full(len(rots), int(y))
+
+    deltaDistX, deltaDistY = np.abs(1/rayDirX), np.abs(1/rayDirY)
+
+    stepX = np.where(rayDirX < 0, -1, 1)
+    sideDistX = np.where(rayDirX < 0, (x - int(x)) * deltaDistX, (int(x) + 1.0 - x) * deltaDistX)
+    stepY = np.where(rayDirY < 0, -1, 1)
+    sideDistY = np.where(rayDirY < 0, (y - int(y)) * deltaDistY, (int(y) + 1.0 - y) * deltaDistY)
+
+    active = np.ones(len(rots), bool) # rays still marching
+    for i in range(30):
+        side = sideDistX >= sideDistY
+        sideDistX = np.where(side, sideDistX, sideDistX + deltaDistX)
+        sideDistY = np.where(side, sideDistY + deltaDistY, sideDistY)
+        mapX, mapY = np.where(side, mapX, mapX + stepX), np.where(side, mapY + stepY, mapY)
+        dist = np.where(side, sideDistY, sideDistX)
+        active &= (mapX >= 0) & (mapX <= sizeX) & (mapY >= 0) & (mapY <= sizeY)
+        cell = mapa[np.clip(mapX, 0, sizeX), np.clip(mapY, 0, sizeY)]
+        dist2 = np.where(side, dist - deltaDistY, dist - deltaDistX) + 0.0001
+        near = active & (cell > 0) & (dist_near == 999)
+        far = active & (cell > 2)
+        dist_near, side_near = np.where(near, dist2, dist_near), np.where(near, side, side_near)
+        dist_far, side_far = np.where(far, dist2, dist_far), np.where(far, side, side_far)
+        active &= ~far
+        if not active.any():
+            break
+
+    x1 = np.where(dist_near < 999, (x + rayDirX*dist_near)%sizeX, 0)
+    y1 = np.where(dist_near < 999, (y + rayDirY*dist_near)%sizeY, 0)
+    x2 = np.where(dist_far < 999, (x + rayDirX*dist_far)%sizeX, 0)
+    y2 = np.where(dist_far < 999, (y + rayDirY*dist_far)%sizeY, 0)
+
+    return x1, y1, x2, y2, dist_near, dist_far, side_near, side_far
+
+def vision(posx, posy, enx, eny, dist2p, maph, size):
+    cos, sin = (posx-enx)/dist2p, (posy-eny)/dist2p
+    x, y = enx, eny
+    seen = 1
+    x, y = x +0.25*cos, y +0.25*sin
+    for i in range(abs(int((dist2p-0.5)/0.05))):
+        x, y = x +0.05*cos, y +0.05*sin
+        if (maph[int(x-0.02)%(size-1)][int(y-0.02)%(size-1)] or
+            maph[int(x-0.02)%(size-1)][int(y+0.02)%(size-1)] or
+            maph[int(x+0.02)%(size-1)][int(y-0.02)%(size-1)] or
+            maph[int(x+0.02)%(size-1)][int(y+0.02)%(size-1)]):
+            seen = 0
+            break
+    return seen
+
+def visions(posx, posy, enx, eny, dist2p, maph, size): # vision for an array of enemies, all rays marched together
+    cos, sin = (posx-enx)/dist2p, (posy-eny)/dist2p
+    steps = np.abs(((dist2p-0.5)/0.05).astype(int))
+    n = steps.max(initial=0)
+    x = np.cumsum(np.column_stack([enx +0.25*cos, np.repeat(0.05*cos[:, None], n, 1)]), 1)[:, 1:] # same sums as vision
+    y = np.cumsum(np.column_stack([eny +0.25*sin, np.repeat(0.05*sin[:, None], n, 1)]), 1)[:, 1:]
+    blocked = np.zeros(x.shape, bool)
+    for dx in (-0.02, 0.02):
+        for dy in (-0.02, 0.02):
+            blocked |= maph[(x+dx).astype(int)%(size-1), (y+dy).astype(int)%(size-1)] != 0
+    return ~(blocked & (np.arange(n) < steps[:, None])).any(1)
+
+def check_walls(posx, posy, maph, x, y): # for walking
+    if not(maph[int(x-0.2)][int(y)] or maph[int(x+0.2)][int(y)] or #check all sides
+           maph[int(x)][int(y-0.2)] or maph[int(x)][int(y+0.2)]):
+        posx, posy = x, y
+
+    elif not(maph[int(posx-0.2)][int(y)] or maph[int(posx+0.2)][int(y)] or # move only in y
+             maph[int(posx)][int(y-0.2)] or maph[int(posx)][int(y+0.2)]):
+        posy = y
+
+    elif not(maph[int(x-0.2)][int(posy)] or maph[int(x+0.2)][int(posy)] or # move only in x
+             maph[int(x)][int(posy-0.2)] or maph[int(x)][int(posy+0.2)]):
+        posx = x
+
+    return posx, posy
+
+def check_walls_many(posx, posy, maph, x, y): # check_walls for arrays of walkers
+    both, only_y, only_x = clear_of_walls(maph, x, y), clear_of_walls(maph, posx, y), clear_of_walls(maph, x, posy)
+    only_y &= ~both
+    only_x &= ~both & ~only_y
+    return np.where(both | only_x, x, posx), np.where(both | only_y, y, posy)
+
+def clear_of_walls(maph, x, y): # all sides
+    return ~((maph[(x-0.2).astype(int), y.astype(int)] != 0) | (maph[(x+0.2).astype(int), y.astype(int)] != 0) |
+             (maph[x.astype(int), (y-0.2).astype(int)] != 0) | (maph[x.astype(int), (y+0.2).astype(int)] != 0))
+
+def angle2p(posx, posy, enx, eny): # math (libm) rather than np so both backends round alike
+    angle = math.atan((eny-posy)/(enx-posx+1e-16))
+    if abs(posx+math.cos(angle)-enx) > abs(posx-enx):
+        angle = (angle - math.pi)%(2*math.pi)
+    return angle
+
+def angles2p(posx, posy, enx, eny): # angle2p for arrays of enemies
+    angle = np.arctan((eny-posy)/(enx-posx+1e-16))
+    return np.where(np.abs(posx+np.cos(angle)-enx) > np.abs(posx-enx), (angle - np.pi)%(2*np.pi), angle)
+
+def cast_floor(out, x, y, cos, sin, depth, level, texels, starts, sizes, ratios, size): # float32 texel lookup
+    xxs = ((x + depth*cos[:, None])%size[0])*ratios[level, 0]
+    yys = ((y + depth*sin[:, None])%size[1])*ratios[level, 1]
+    out[:] = texels[starts[level] + xxs.astype(np.int32)*sizes[level, 1] + yys.astype(np.int32)]
+
+def sample_walls(out, strips, top, scale, heights, row0): # packed texture columns stretched over out, filtered along them
+    slope, start = wall_rows(top, scale, heights, row0)
+    lo, hi = np.clip(top - row0, 0, out.shape[1]), np.clip(top + scale - row0, 0, out.shape[1])
+    n, size, counts = *strips.shape, hi - lo # only the pixels of each column from here, not the box around them all
+    col = np.repeat(np.arange(n, dtype=np.int32), counts)
+    row = np.arange(counts.sum(), dtype=np.int32) - np.repeat((np.cumsum(counts) - hi).astype(np.int32), counts)
+    v = np.maximum(row.astype(np.float32)*np.repeat(slope, counts) + np.repeat(start, counts), np.float32(0)) # texture row
+    near = v.astype(np.int32)
+    w = ((v - near)*np.float32(256)).astype(np.uint32) # linear between the two nearest rows
+    pairs = np.empty((n, size, 2), np.uint32) # every texel next to the one below, the last one of a column next to itself
+    pairs[..., 0] = strips
+    pairs[:, :-1, 1] = strips[:, 1:]
+    pairs[np.arange(n), heights-1, 1] = strips[np.arange(n), heights-1]
+    both = pairs.view(np.uint64).ravel().take(near + np.repeat(np.arange(0, n*size, size, dtype=np.int32), counts))
+    near, far = both.view(np.uint32)[0::2], both.view(np.uint32)[1::2]
+    even = np.uint32(0x00ff00ff) # two channels at a time, a byte apart so the products do not overlap
+    pixels = ((near & even)*(256-w) + (far & even)*w) >> np.uint32(8) & even
+    pixels |= ((near >> np.uint32(8) & even)*(256-w) + (far >> np.uint32(8) & even)*w) & ~even
+    out[col, row] = pixels
+
+def wall_rows(top, scale, heights, row0): # per column, texture row = slope*(row in out) + start, in float32 for both backends
+    stretch = scale >= heights # mapped like smoothscale magnifies, otherwise from the pixel centres
+    slope = np.where(stretch, (heights-1)/np.maximum(scale, 1), heights/np.maximum(scale, 1))
+    start = np.where(stretch, 0, slope/2 - 0.5) + (row0 - top)*slope
+    return slope.astype(np.float32), start.astype(np.float32)
+
+
+if njit:
+    jit_dda_ray = njit(cache=True)(dda_ray)
+    jit_vision = njit(cache=True)(vision)
+    jit_check_walls = njit(cache=True)(check_walls)
+    jit_angle2p = njit(cache=True)(angle2p)
+
+    @njit(cache=True, nogil=True)
+    def jit_cast_rays(x, y, sin, cos, mapa):
+        hits = np.zeros((6, len(sin)))
+        sides = np.zeros((2, len(sin)), np.int64)
+        for i in range(len(sin)):
+            x1, y1, x2, y2, dist_near, dist_far, side_near, side_far = jit_dda_ray(x, y, sin[i], cos[i], mapa)
+            hits[0, i], hits[1, i], hits[2, i], hits[3, i], hits[4, i], hits[5, i] = x1, y1, x2, y2, dist_near, dist_far
+            sides[0, i], sides[1, i] = side_near, side_far
+        return hits, sides
+
+    @njit(cache=True)
+    def jit_visions(posx, posy, enx, eny, dist2p, maph, size):
+        seen = np.zeros(len(enx), np.bool_)
+        for i in range(len(enx)):
+            seen[i] = jit_vision(posx, posy, enx[i], eny[i], dist2p[i], maph, size)
+        return seen
+
+    @njit(cache=True, nogil=True)
+    def jit_cast_floor(out, x, y, cos, sin, depth, level, texels, starts, sizes, ratios, size):
+        for i in range(depth.shape[0]):
+            for j in range(depth.shape[1]):
+                l = level[i, j]
+                xx = int(((x + depth[i, j]*cos[i])%size[0])*ratios[l, 0])
+                yy = int(((y + depth[i, j]*sin[i])%size[1])*ratios[l, 1])
+                t = starts[l] + xx*sizes[l, 1] + yy
+                out[i, j, 0], out[i, j, 1], out[i, j, 2] = texels[t, 0], texels[t, 1], texels[t, 2]
+
+    @njit(cache=True, nogil=True)
+    def jit_sample_rows(out, strips, top, scale, heights, row0, slope, start):
+        even = np.uint32(0x00ff00ff)
+        for i in range(out.shape[0]):
+            h = heights[i]
+            for j in range(max(0, top[i] - row0), min(out.shape[1], top[i] + scale[i] - row0)):
+                v = max(np.float32(j)*slope[i] + start[i], np.float32(0))
+                k = min(int(v), h-1)
+                w = np.uint32((v - np.float32(k))*np.float32(256))
+                near, far = strips[i, k], strips[i, min(k+1, h-1)]
+                out[i, j] = (((near & even)*(256-w) + (far & even)*w) >> 8 & even |
+                             ((near >> 8 & even)*(256-w) + (far >> 8 & even)*w) & ~even)
+
+    def jit_sample_walls(out, strips, top, scale, heights, row0):
+        jit_sample_rows(out, strips, top, scale, heights, row0, *wall_rows(top, scale, heights, row0))
+
+    def jit_lodev_DDA_rays(x, y, rots, mapa):
+        hits, sides = jit_cast_rays(float(x), float(y), np.sin(rots), np.cos(rots), mapa)
+        return (*hits, *sides)
+
+def use(backend=os.environ.get('DEAD_END_KERNELS', 'auto')):
+    global BACKEND, lodev_DDA_rays, vision, visions, check_walls, angle2p, cast_floor, sample_walls
+    if backend == 'auto':
+        backend = 'numba' if njit else 'numpy'
+    if backend == 'numba' and not njit:
+        raise ImportError("numba is not installed, use the 'numpy' kernels")
+    lodev_DDA_rays, vision, visions, check_walls, angle2p, cast_floor, sample_walls = KERNELS[backend]
+    BACKEND = backend
+
+KERNELS = {'numpy': (lodev_DDA_rays, vision, visions, check_walls, angle2p, cast_floor, sample_walls)}
+if njit:
+    KERNELS['numba'] = (jit_lodev_DDA_rays, jit_vision, jit_visions, jit_check_walls, jit_angle2p, jit_cast_floor,
+                        jit_sample_walls)
+use()